@@ -1,11 +1,21 @@
-import primesense.openni2 as oni
+import os
 import cv2
 import cv2.cv as cv
 import numpy as np
+import time
+import threading
+import registration
+import timing
 from wrapPare.prepare import Prepare
 from process.history import StateHistory
-from wrapPare.postpare import saveHistory
+from process.smoothing import smoothHistory
+from wrapPare.postpare import saveHistory, saveHistoryBinary, loadHistory, HistoryWriter
+from wrapPare.precompute import precompute, unpack
 from process.adjust import Adjustment
+from process.deadline import Deadline, Clock
+from frames.prefetch import FramePrefetcher
+from frames.cache import FrameCache
+from frames.source import openSource
 
 class PyTrackerApp(object):
     '''
@@ -16,142 +26,333 @@ class PyTrackerApp(object):
     PyTracker tracks joints of a human (occlusions partly supported), saves
     the history to be able to adjust every frame afterwards (consecutive frames
     has to be recalculated) and then saves them in a file
+    
+    frames are processed at resolution scale (relative to VGA), with margin
+    only the region around the arms (+ margin px) is preprocessed, frames
+    are read from source (default: opened from filename)
+    
+    interactively, decoded frames, their display and edge images are kept
+    in a cache of cacheSize bytes: scrubbing and adjusting decode a frame once
     '''
 
-    def __init__(self, filename):
-        oni.initialize()
+    def __init__(self, filename, scale=1.0, margin=None, source=None, cacheSize=256*2**20):
+        registration.setScale(scale)
         self.filename = filename
-        self.dev = oni.Device.open_file(filename)
-        
-        self.player = oni.PlaybackSupport(self.dev)
-        self.player.set_speed(-1)
-        self.depth_stream = self.dev.create_depth_stream()
-        self.clr_stream = self.dev.create_color_stream()
-        self.depth_stream.start()
-        self.clr_stream.start()
+        self.source = openSource(filename) if source is None else source
         
         self.prep = Prepare(self)
+        self.prep.preprocessing.margin = margin
         self.skeleton = None
         
         self.pause = 5
-        self.history = StateHistory()
+        self.refresh = 15 # ms, display rate
+        self.lock = threading.RLock()
+        self.tracking = False
+        self.step = False
+        self.latest = None
+        self.history = StateHistory(self.source.getNumberOfFrames())
         self.currentFrameIdx = 0
         self.drag = False
         
         self.adjustment = None
-        for x in self.history.states.keys():
-            self.history.states[x] = [None]*self.player.get_number_of_frames(self.depth_stream)
+        self.prefetcher = None
+        self.cache = FrameCache(cacheSize)
+        self.skeletonImages = None
+        self.writer = None
+        self.loaded = 0 # frames of label file loaded by resume
+        self.tolerance = 10.0 # mm, re-tracking stops if joints are closer to previous states
         
-    def prepare(self):
-        ''' do preparations '''
-        self.prep.thresholding()
-        self.prep.tabling()
+    def prepare(self, tableFile=None, auto=True):
+        ''' do preparations, a table saved in tableFile is reused,
+        with auto table and thresholds are estimated (see tabling and
+        estimateThreshold), otherwise thresholds are set by slider bars
+        '''
+        if not auto:
+            self.prep.thresholding()
+        self.prep.tabling(tableFile, auto)
         self.skeleton = self.prep.posture()
+        if auto:
+            self.prep.estimateThreshold()
+        self.prep.saveSetup(self.filename + ".setup")
+
+    def loadSetup(self, filename):
+        ''' load preparations saved by a previous run instead of windows '''
+        self.skeleton = self.prep.loadSetup(filename)
+        
+    def resume(self):
+        ''' continue an interrupted session: frames of the label file written
+        while tracking (see HistoryWriter) are loaded, the last one is tracked
+        again starting from its stored states (skeleton and motion filters)
+        
+        returns index of the frame tracking continues with
+        '''
+        labels = self.filename + ".label"
+        if not os.path.exists(labels):
+            return self.currentFrameIdx
+        n = loadHistory(labels, self.history)
+        self.loaded = n
+        if n > 0:
+            for joint in self.history.joints:
+                self.skeleton.setState(joint, self.history.get(n-1, joint))
+            self.history.invalidate(n-1)
+            self.history.dirty = len(self.history) # frame n-1 is stored again unchanged
+            self.currentFrameIdx = n-1
+            print "resumed %s at frame %d" % (self.filename, n-1)
+        return self.currentFrameIdx
+    
+    def precompute(self, setup, processes=None):
+        ''' calculate skeleton frames of the whole recording with setup
+        in a pool of processes (see precompute), tracking then only fits
+        '''
+        self.skeletonImages = precompute(self.filename, setup, self.source.getNumberOfFrames(),
+                                         processes=processes)
         
     def mainLoop(self):
-        ''' main loop consisting of distance transformation of frame and then fitting the
-        skeleton, finally saving the state into history, a slider bar allows to navigate
-        through already calculated frames and adjust joints 
+        ''' main loop: a worker thread does the distance transformation of frames,
+        fits the skeleton and saves the states into history (trackingWorker), this
+        loop displays the latest tracked frame at its own rate (frames are dropped
+        if tracking is faster), a slider bar allows to navigate through already
+        calculated frames and adjust joints
+        
+        p: pause, any other key in pause: next frame, q: quit
         '''
-        cannyTop = 30;
-        cannyBot = 15
         key = -1
         
         cv2.namedWindow("main", 1)
         cv2.createTrackbar("Frame id", "main", self.currentFrameIdx,
-                           self.player.get_number_of_frames(self.depth_stream),
+                           self.source.getNumberOfFrames(),
                            self.onTrackbar)
         cv2.setMouseCallback("main", self.onClick)
         
-        while True:
-            incr = self.currentFrameIdx
-            frame = self.getFrame(incr)
+        self.tracking = True
+        worker = threading.Thread(target=self.trackingWorker)
+        worker.daemon = True
+        worker.start()
+        
+        shown = None
+        while worker.is_alive():
+            latest = self.latest
+            if latest is not None and latest is not shown:
+                self.show(*latest)
+                shown = latest
             
-            if incr < self.player.get_number_of_frames(self.depth_stream):
-                keys = self.skeleton.fullStates.keys()
-                ###############################
-                # check history if this frame #
-                # is already calculated       #
-                ###############################
-                if self.history.states[keys[0]][incr] is not None:
-                    for x in keys:
-                        self.skeleton.setState(x, self.history.states[x][incr])
-                else:
-                    for x in keys:
-                        self.history.states[x][incr] = self.skeleton.fullStates[x]
-        
-                    ###############################
-                    # global adjustment to obtain #
-                    # skeleton like frame         #
-                    ###############################
-                    depth = self.prep.apply()
-                    masked = np.copy(depth)
-                    masked = masked/(np.max(masked)-np.min(masked))-np.min(masked)
-                    masked *= 255.
-                    masked = np.rint(masked).astype(np.uint8)
-#                    outA = masked
-                    
-                    depthEdge = cv2.Canny(masked, cannyBot, cannyTop)
-                    depthEdge[self.prep.mask==0] = 255
-#                    outB = depthEdge
-                    
-                    dist = cv2.distanceTransform(~depthEdge, cv.CV_DIST_L2, 3)
-                    dist = self.normFrame(dist)
-#                    outC = dist
-                    skeleton = cv2.adaptiveThreshold(dist, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 13, 0)
-#                    outD = skeleton
-                    
-                    self.skeleton.fit(skeleton)
-                    
-            ######################
-            # some nice outputs  #
-            ######################
-            out2 = cv2.cvtColor(self.normFrame(depthEdge), cv2.COLOR_GRAY2BGR)    
-            out = cv2.cvtColor(self.normFrame(frame), cv2.COLOR_GRAY2BGR)
-            cv2.putText(out, str(self.currentFrameIdx-1), (600, 30), cv2.FONT_HERSHEY_COMPLEX, 0.5, (0,255,0))
-            for i in self.skeleton.joints:
-                cv2.circle(out2, self.skeleton.states[i][:2], 5, (255,255,0), -1)
-                cv2.circle(out, self.skeleton.states[i][:2], 5, (255,255,0), -1)
-                
-#            cv2.imshow("A", outA)
-#            cv2.imshow("B", outB)
-#            cv2.imshow("C", outC)
-#            cv2.imshow("D", outD)
-
-            cv2.imshow("main", out)
-            cv2.imshow("skeleton", out2)
-
-            key = cv.WaitKey(self.pause)
-            if incr < self.player.get_number_of_frames(self.depth_stream):
-                self.currentFrameIdx += 1 # only increase index, if further frames can be read
+            key = cv.WaitKey(self.refresh)
             if key == 113: # q
                 break
             if key == 112: # p
                 self.pause = 5 if self.pause == 0 else 0
-        saveHistory(self.filename + ".label", self.history)
+            elif key != -1 and self.pause == 0:
+                self.step = True
+        self.tracking = False
+        worker.join()
+        self.saveLabels()
+        self.reportTiming()
+        
+    def trackingWorker(self):
+        ''' track frames into the history as long as not paused (in pause
+        only single steps), the latest frame is published for display,
+        tracked frames are written to the label file in batches
+        '''
+        nFrames = self.source.getNumberOfFrames()
+        self.writer = HistoryWriter(self.filename + ".label", self.history, self.loaded)
+        while self.tracking:
+            if self.drag or (self.pause == 0 and not self.step) or \
+               (self.currentFrameIdx >= nFrames and not self.step):
+                time.sleep(0.005)
+                continue
+            with self.lock:
+                self.step = False
+                incr = self.currentFrameIdx
+                frame = self.getFrame(incr)
                 
+                edge = None # only the edge frame of this frame is shown
+                if incr < nFrames:
+                    newEdge = self.trackFrame(incr)
+                    if newEdge is not None:
+                        edge = self.cache.put(incr, 'edge', np.copy(newEdge))
+                    else:
+                        edge = self.cache.get(incr, 'edge') # frame taken from history
+                self.latest = (incr, frame, edge, dict(self.skeleton.states))
+                if incr < nFrames:
+                    self.currentFrameIdx += 1 # only increase index, if further frames can be read
+                self.writer.update()
+                    
+    def show(self, incr, frame, edge, states):
+        ''' display frame with joints states and its edge frame '''
+        ######################
+        # some nice outputs  #
+        ######################
+        out = cv2.cvtColor(self.displayFrame(incr, frame), cv2.COLOR_GRAY2BGR)
+        cv2.putText(out, str(incr), (out.shape[1]-40, 30), cv2.FONT_HERSHEY_COMPLEX, 0.5, (0,255,0))
+        for i in self.skeleton.joints:
+            cv2.circle(out, states[i][:2], 5, (255,255,0), -1)
+        cv2.imshow("main", out)
+        if edge is not None:
+            out2 = cv2.cvtColor(self.normFrame(edge), cv2.COLOR_GRAY2BGR)
+            for i in self.skeleton.joints:
+                cv2.circle(out2, states[i][:2], 5, (255,255,0), -1)
+            cv2.imshow("skeleton", out2)
+
+    def saveLabels(self):
+        ''' save history as text and binary label file '''
+        saveHistory(self.filename + ".label", self.history)
+        saveHistoryBinary(self.filename + ".label.npy", self.history)
+        self.loaded = self.history.stored() # rows of label file
+        self.history.dirty = len(self.history)
+
+    def saveSmoothed(self):
+        ''' smooth all tracked frames offline (see smoothHistory) and save
+        them as separate label files, tracked labels are kept
+        '''
+        smoothed = smoothHistory(self.history, self.skeleton)
+        saveHistory(self.filename + ".smooth.label", smoothed)
+        saveHistoryBinary(self.filename + ".smooth.label.npy", smoothed)
+
+    def trackFrame(self, incr):
+        ''' track the current frame (read by getFrame) with index incr,
+        if it is already in the history, the skeleton is set to this state
+
+        returns edge image of frame or None if frame was taken from history
+        or its skeleton frame was precomputed
+        '''
+        timing.setFrame(incr)
+        ################################
+        # re-tracking after adjustment #
+        # stops if states reconverge   #
+        ################################
+        if self.history.reconverged(incr, self.skeleton.fullStates, self.tolerance):
+            print "reconverged at %d, %d frames kept" % (incr, self.history.restore(incr))
+        ###############################
+        # check history if this frame #
+        # is already calculated       #
+        ###############################
+        if self.history.has(incr):
+            for x in self.history.joints:
+                self.skeleton.setState(x, self.history.get(incr, x))
+            return None
+
+        self.history.set(incr, self.skeleton.fullStates)
+
+        if self.skeletonImages is not None:
+            with timing.stage("unpack"):
+                skeleton = unpack(self.skeletonImages[incr])
+            self.skeleton.fit(skeleton)
+            return None
         
+        ###############################
+        # global adjustment to obtain #
+        # skeleton like frame         #
+        ###############################
+        depth = self.prep.apply()
+        arms = [self.skeleton.states[x] for x in self.skeleton.joints if x != 'head']
+        with timing.stage("Preprocessing.apply"):
+            skeleton = self.prep.preprocessing.apply(depth, self.prep.mask, arms)
+
+        self.skeleton.fit(skeleton)
+        return self.prep.preprocessing.edge
+
+    def track(self):
+        ''' headless tracking: track all remaining frames without any window
+        and save the history, a setup has to be loaded before (loadSetup),
+        if timing is enabled, statistics and trace of the stages are written
+
+        returns frames per second
+        '''
+        nFrames = self.source.getNumberOfFrames()
+        start = time.time()
+        first = self.currentFrameIdx
+        self.prefetcher = FramePrefetcher(self.source.read, nFrames, shape=registration.shape)
+        self.writer = HistoryWriter(self.filename + ".label", self.history, self.loaded)
+        try:
+            for incr in range(first, nFrames):
+                self.currentFrameIdx = incr
+                self.getFrame(incr)
+                self.trackFrame(incr)
+                self.writer.update()
+        finally:
+            self.prefetcher.stop()
+            self.prefetcher = None
+            self.writer.update(flush=True)
+        self.currentFrameIdx = nFrames
+        duration = time.time() - start
+        self.saveLabels()
+        self.reportTiming()
+        return (nFrames - first)/duration if duration > 0 else 0.0
+
+    def reportTiming(self):
+        ''' if timing is enabled, print statistics of the stages and
+        write the trace (filename.trace.json) if it is kept
+        '''
+        if timing.enabled:
+            timing.report()
+            if timing.keepTrace:
+                timing.dumpTrace(self.filename + ".trace.json")
+
+    def trackRealtime(self, fps=30.0, clock=None):
+        ''' live-style tracking of all remaining frames: frames arrive at fps
+        (measured by clock, default: wall clock, a SimulatedClock makes runs
+        reproducible), every frame has to be tracked before the next one
+        arrives, the fit adapts to the remaining time (see Deadline)
+        
+        returns deadline with counts of late frames and degraded fits
+        '''
+        clock = Clock() if clock is None else clock
+        deadline = Deadline(1.0/fps, clock)
+        nFrames = self.source.getNumberOfFrames()
+        first = self.currentFrameIdx
+        start = clock.now()
+        self.skeleton.deadline = deadline
+        try:
+            for incr in range(first, nFrames):
+                arrival = start + (incr - first)/fps
+                wait = arrival - clock.now()
+                if wait > 0:
+                    clock.sleep(wait)
+                deadline.start(arrival)
+                self.currentFrameIdx = incr
+                self.getFrame(incr)
+                self.trackFrame(incr)
+                deadline.finish()
+        finally:
+            self.skeleton.deadline = None
+        self.currentFrameIdx = nFrames
+        self.saveLabels()
+        return deadline
+
     def getFrame(self, frameIdx=-1):
-        ''' read a frame at index frameIdx '''
-        if frameIdx >= 0:
-            self.player.seek(self.depth_stream, frameIdx)
-        depth = self.depth_stream.read_frame()
-        depth= np.ctypeslib.as_array(depth.get_buffer_as_uint16())
-        depth = depth.reshape((480,640))
-        depth = np.float32(depth)
+        ''' read a frame at index frameIdx, outside of headless tracking
+        frames are decoded once and then taken from the cache
+        '''
+        timing.setFrame(frameIdx)
+        with timing.stage("getFrame"):
+            if self.prefetcher is not None:
+                depth = self.prefetcher.get(frameIdx)
+            elif frameIdx >= 0:
+                depth = self.cache.getOrCreate(frameIdx, 'depth', lambda: self.decodeFrame(frameIdx))
+            else:
+                depth = self.decodeFrame(frameIdx)
         self.prep.table.depth = depth
         self.prep.skeleton.depth = depth
         return depth
+    
+    def decodeFrame(self, frameIdx):
+        ''' decode frame frameIdx at processing resolution '''
+        return np.float32(registration.downsample(self.source.getFrame(frameIdx)))
+    
+    def displayFrame(self, frameIdx, frame):
+        ''' normalized frame for display (cached) '''
+        return self.cache.getOrCreate(frameIdx, 'display', lambda: self.normFrame(frame))
 
     def onTrackbar(self, param):
         ''' pause tracking and set currentFrameIdx to slider bar index'''
         self.pause = 0
         currentFrameIdx = cv2.getTrackbarPos("Frame id", "main")
-        key = self.history.states.keys()[0]
-        idx =  next(i for i, j in enumerate(self.history.states[key]) if j is None)
-        if currentFrameIdx > idx:
-            currentFrameIdx = idx
-        self.currentFrameIdx = currentFrameIdx
+        with self.lock:
+            idx = self.history.tracked
+            if currentFrameIdx > idx:
+                currentFrameIdx = idx
+            self.currentFrameIdx = currentFrameIdx
+            self.step = True # show chosen frame
         
     def onClick(self, event, x, y, flag, param):
         ''' in pause modus be able to adjust joints manually with left click
@@ -160,6 +361,16 @@ class PyTrackerApp(object):
         
         if self.pause != 0:
             return
+        with self.lock:
+            self.adjust(event, x, y)
+            
+    def adjust(self, event, x, y):
+        ''' adjust joint with mouse event at x, y (see onClick) in the
+        displayed frame, tracking continues with the frame after it
+        '''
+        if self.latest is None:
+            return
+        idx = self.latest[0] # displayed frame, currentFrameIdx is the next one
         if event == cv2.EVENT_LBUTTONDOWN:
             keys = ['wristRight', 'wristLeft', 'elbowRight', 'elbowLeft']
             for key in keys:
@@ -173,18 +384,19 @@ class PyTrackerApp(object):
                     ###########################
                     # load state from history #
                     # all consecutive states  #
-                    # are deleted             #
+                    # are re-tracked until    #
+                    # they reconverge         #
                     ###########################
+                    self.history.invalidate(idx+1, keep=True)
                     for k in keys:
-                        l = len(self.history.states[key])
-                        self.history.states[k][self.currentFrameIdx+1:] = [None]*(l-self.currentFrameIdx)
-                        self.skeleton.setState(k, self.history.states[k][self.currentFrameIdx])
+                        self.skeleton.setState(k, self.history.get(idx, k))
                     ###########################################
                     # state for adjusted joint is set by user #
                     # therefore, load previous state          #
                     ###########################################
-                    self.skeleton.setState(key, self.history.states[k][self.currentFrameIdx-1])
-                    self.adjustment = Adjustment(self.getFrame(self.currentFrameIdx), self.skeleton, key)
+                    self.skeleton.setState(key, self.history.get(max(idx-1, 0), key))
+                    self.adjustment = Adjustment(self.getFrame(idx), self.skeleton, key)
+                    self.currentFrameIdx = idx+1
                     self.drag = True
                     break
         elif event == cv2.EVENT_MOUSEMOVE and self.drag:
@@ -192,10 +404,10 @@ class PyTrackerApp(object):
             # update joint position     #
             # as mouse position changes #
             #############################
-            frame = self.getFrame(self.currentFrameIdx)
+            frame = self.getFrame(idx)
             self.adjustment.updatePosition(x, y, frame[y,x])
-            out = cv2.cvtColor(self.normFrame(frame), cv2.COLOR_GRAY2BGR)
-            cv2.putText(out, str(self.currentFrameIdx-1), (600, 30), cv2.FONT_HERSHEY_COMPLEX, 0.5, (0,255,0))
+            out = cv2.cvtColor(self.displayFrame(idx, frame), cv2.COLOR_GRAY2BGR)
+            cv2.putText(out, str(idx), (out.shape[1]-40, 30), cv2.FONT_HERSHEY_COMPLEX, 0.5, (0,255,0))
             for i in self.skeleton.joints:
                 cv2.circle(out, self.skeleton.states[i][:2], 5, (255,255,0), -1)
             cv2.imshow("main", out)
@@ -204,9 +416,7 @@ class PyTrackerApp(object):
             # set joint to mouse position #
             ###############################
             print "lost at", x, y
-            keys = self.skeleton.fullStates.keys()
-            for key in keys:
-                self.history.states[key][self.currentFrameIdx] = self.skeleton.fullStates[key]
+            self.history.set(idx, self.skeleton.fullStates)
             self.drag = False
              
     def normFrame(self, frame):
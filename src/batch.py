@@ -0,0 +1,116 @@
+import sys
+import os
+import time
+import traceback
+import numpy as np
+from multiprocessing import Pool
+import timing
+from main import parseOptions
+
+#################################
+# headless tracking of a whole  #
+# study: every recording with   #
+# its setup in its own process  #
+#################################
+extensions = ('.oni', '.npy', '.raw')
+
+def findRecordings(path):
+    ''' recordings (filename, setup, scale) of a directory (every
+    recording with a filename.setup next to it) or of a manifest
+    (lines: filename setup [scale], relative to the manifest)
+    '''
+    if os.path.isdir(path):
+        recordings = []
+        for name in sorted(os.listdir(path)):
+            filename = os.path.join(path, name)
+            if name.endswith(extensions) and os.path.exists(filename + ".setup"):
+                recordings.append((filename, filename + ".setup", 1.0))
+        return recordings
+    base = os.path.dirname(path)
+    recordings = []
+    with open(path, 'r') as ifile:
+        for line in ifile:
+            entry = line.split()
+            if len(entry) == 0 or entry[0].startswith('#'):
+                continue
+            scale = float(entry[2]) if len(entry) > 2 else 1.0
+            recordings.append((os.path.join(base, entry[0]), os.path.join(base, entry[1]), scale))
+    return recordings
+
+def isComplete(filename, nFrames):
+    ''' labels of all frames are written (binary label file is written last) '''
+    labels = filename + ".label.npy"
+    return os.path.exists(labels) and os.path.exists(filename + ".label") and \
+           len(np.load(labels, mmap_mode='r')) == nFrames
+
+def trackRecording(recording):
+    ''' track one recording (filename, setup, scale, margin) in this process
+    
+    returns (filename, status, frames, frames/second, clamped motions,
+    seconds, message)
+    '''
+    filename, setup, scale, margin = recording
+    start = time.time()
+    try:
+        from app import PyTrackerApp
+        app = PyTrackerApp(filename, scale, margin)
+        nFrames = app.source.getNumberOfFrames()
+        if isComplete(filename, nFrames):
+            return (filename, 'skipped', nFrames, 0.0, 0, time.time() - start, '')
+        app.loadSetup(setup)
+        app.resume()
+        fps = app.track()
+        clamped = sum(app.skeleton.clamped().values())
+        return (filename, 'done', nFrames, fps, clamped, time.time() - start, '')
+    except Exception:
+        message = traceback.format_exc().strip().splitlines()[-1]
+        return (filename, 'failed', 0, 0.0, 0, time.time() - start, message)
+
+def batch(path, processes=None, summary=None, trace=None, margin=None):
+    ''' track all recordings of a directory or manifest (see findRecordings)
+    in a pool of processes, every recording gets a fresh process (own
+    OpenNI device), recordings with complete labels are skipped and
+    interrupted ones continue at their last written frame, so an
+    interrupted batch is resumed by running it again
+    
+    returns results (see trackRecording) in order of recordings,
+    also written to summary (default: batch.summary next to path)
+    
+    with trace not None stages are timed in every process (see timing),
+    with trace True also written to filename.trace.json, with margin only
+    the region around the arms is preprocessed (see PyTrackerApp)
+    '''
+    recordings = findRecordings(path)
+    if summary is None:
+        summary = os.path.join(path if os.path.isdir(path) else os.path.dirname(path), "batch.summary")
+    if trace is None:
+        pool = Pool(processes, maxtasksperchild=1)
+    else:
+        pool = Pool(processes, timing.enable, (trace,), maxtasksperchild=1)
+    results = {}
+    try:
+        for result in pool.imap_unordered(trackRecording, [recording + (margin,) for recording in recordings]):
+            results[result[0]] = result
+            print "%-8s %s (%d frames, %.1f frames/second, %d clamped)" % (result[1], result[0], result[2],
+                                                                           result[3], result[4])
+        pool.close()
+    finally:
+        pool.terminate()
+    results = [results[recording[0]] for recording in recordings]
+    with open(summary, 'w') as ifile:
+        ifile.write("status frames fps clamped seconds filename message\n")
+        for filename, status, frames, fps, clamped, seconds, message in results:
+            ifile.write("%s %d %.1f %d %.1f %s %s\n" % (status, frames, fps, clamped, seconds, filename, message))
+    counts = dict((status, sum(1 for r in results if r[1] == status)) for status in ['done', 'skipped', 'failed'])
+    print "%d recordings: %d done, %d skipped, %d failed, summary in %s" % (len(results), counts['done'],
+                                                                            counts['skipped'], counts['failed'], summary)
+    return results
+
+if __name__ == '__main__':
+    # batch.py directory|manifest [processes [summary]] [--timing[=trace]] [--margin[=px]]
+    argv, options = parseOptions(sys.argv)
+    processes = int(argv[2]) if len(argv) > 2 else None
+    summary = argv[3] if len(argv) > 3 else None
+    trace = options['timing'] == 'trace' if 'timing' in options else None
+    margin = int(options['margin'] or 30) if 'margin' in options else None
+    batch(argv[1], processes, summary, trace, margin)
@@ -0,0 +1,106 @@
+import sys
+import os
+import copy
+import time
+import tempfile
+import numpy as np
+import registration
+import timing
+from app import PyTrackerApp
+from main import parseOptions
+from frames.synthetic import SyntheticSource
+
+def measure(fn, repeat, setup=None):
+    ''' durations (s) of repeat calls of fn, setup is called
+    before every call and not measured, its result is passed to fn
+    '''
+    durations = np.zeros(repeat)
+    for i in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.time()
+        if setup is not None:
+            fn(arg)
+        else:
+            fn()
+        durations[i] = time.time() - start
+    return durations
+
+def report(name, durations):
+    mean = np.mean(durations)
+    print "%-24s %9.3f ms mean %9.3f ms max %9.1f /s" % (name, mean*1000, np.max(durations)*1000,
+                                                        1.0/mean if mean > 0 else 0)
+
+def benchmark(nFrames=100, scale=1.0, repeat=20, reference=None):
+    ''' track a synthetic recording headlessly, time every stage and
+    the whole pipeline per frame and compare joints with the truth
+    
+    reference: .npy of tracked joints of a previous run, written if it
+    does not exist, otherwise the deviation to it is reported
+    '''
+    source = SyntheticSource(nFrames)
+    tmp = tempfile.mkdtemp()
+    setup = os.path.join(tmp, "synthetic.setup")
+    source.writeSetup(setup)
+    app = PyTrackerApp(os.path.join(tmp, "synthetic"), scale, source=source)
+    app.loadSetup(setup)
+    
+    ###### end-to-end ######
+    perFrame = np.zeros(nFrames)
+    errors = []
+    tracked = np.zeros((nFrames, len(app.history.joints), 3))
+    for i in range(nFrames):
+        start = time.time()
+        app.getFrame(i)
+        app.trackFrame(i)
+        perFrame[i] = time.time() - start
+        errors.append(source.error(i, app.skeleton.fullStates))
+        tracked[i] = [app.skeleton.fullStates[j].pt for j in app.history.joints]
+    if timing.enabled:
+        # stages of the end-to-end run, not of the measurements below
+        app.reportTiming()
+        timing.disable()
+    
+    ###### stages on last frame ######
+    prep = app.prep
+    depth = prep.table.filter().copy()
+    mask = prep.masking(depth, prep.threshold).copy()
+    skeleton = prep.preprocessing.apply(depth, mask).copy()
+    rgb = np.dstack([app.normFrame(source.getFrame(nFrames-1))]*3)
+    fullDepth = np.float32(source.getFrame(nFrames-1))
+    
+    print "synthetic recording: %d frames, scale %.2f" % (nFrames, scale)
+    report("decodeFrame", measure(lambda: app.decodeFrame(nFrames-1), repeat)) # getFrame would hit the cache
+    report("Table.calcTable", measure(prep.table.calcTable, repeat))
+    report("Table.filter", measure(prep.table.filter, repeat))
+    report("Prepare.masking", measure(lambda: prep.masking(depth, prep.threshold), repeat))
+    report("Preprocessing.apply", measure(lambda: prep.preprocessing.apply(depth, mask), repeat))
+    report("Skeleton.fit", measure(lambda sk: sk.fit(skeleton), repeat,
+                                   lambda: copy.deepcopy(app.skeleton)))
+    report("Skeleton.fitPart", measure(lambda sk: sk.fitPart(skeleton, 'shoulderLeft', 'elbowLeft', 'wristLeft'),
+                                       repeat, lambda: copy.deepcopy(app.skeleton)))
+    report("registration.register", measure(lambda: registration.register(rgb, fullDepth), repeat))
+    report("StateHistory.dump", measure(app.history.dump, max(1, repeat//10)))
+    report("frame (end-to-end)", perFrame)
+    
+    for joint in app.history.joints:
+        err = np.asarray([e[joint] for e in errors])
+        print "%-24s %9.1f mm mean %9.1f mm max error" % (joint, np.mean(err), np.max(err))
+    
+    if reference is not None:
+        if os.path.exists(reference):
+            ref = np.load(reference)
+            n = min(len(ref), len(tracked))
+            print "max deviation to reference: %.3f mm" % np.max(np.abs(ref[:n] - tracked[:n]))
+        else:
+            np.save(reference, tracked)
+    return perFrame, errors
+
+if __name__ == '__main__':
+    # benchmark.py [frames [scale [reference.npy]]] [--timing[=trace]]
+    argv, options = parseOptions(sys.argv)
+    if 'timing' in options:
+        timing.enable(trace=options['timing'] == 'trace')
+    nFrames = int(argv[1]) if len(argv) > 1 else 100
+    scale = float(argv[2]) if len(argv) > 2 else 1.0
+    reference = argv[3] if len(argv) > 3 else None
+    benchmark(nFrames, scale, reference=reference)
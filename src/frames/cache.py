@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+
+class FrameCache(object):
+    '''
+    class keeping decoded frames and images derived from them (e.g.
+    'depth', 'display', 'edge') by frame index within a memory budget
+    
+    - the least recently used frame is dropped with all its images
+      if the budget (bytes) is exceeded
+    - cached images are read only, they are shared by all users
+    - thread safe, tracking and display access it concurrently
+    '''
+    
+    
+    def __init__(self, budget=256*2**20):
+        self.budget = budget
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        
+    def get(self, frameIdx, name):
+        ''' image name of frame frameIdx or None if not cached '''
+        with self.lock:
+            entry = self.entries.pop(frameIdx, None)
+            if entry is None or name not in entry:
+                if entry is not None:
+                    self.entries[frameIdx] = entry
+                self.misses += 1
+                return None
+            self.entries[frameIdx] = entry # most recently used
+            self.hits += 1
+            return entry[name]
+    
+    def put(self, frameIdx, name, image):
+        ''' keep image name of frame frameIdx, returns the cached image '''
+        image.flags.writeable = False
+        with self.lock:
+            entry = self.entries.pop(frameIdx, {})
+            if name in entry:
+                self.size -= entry[name].nbytes
+            entry[name] = image
+            self.size += image.nbytes
+            self.entries[frameIdx] = entry
+            while self.size > self.budget and len(self.entries) > 1:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= sum(im.nbytes for im in dropped.values())
+        return image
+    
+    def getOrCreate(self, frameIdx, name, create):
+        ''' image name of frame frameIdx, created by create() if not cached '''
+        image = self.get(frameIdx, name)
+        if image is None:
+            image = self.put(frameIdx, name, create())
+        return image
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
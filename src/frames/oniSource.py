@@ -0,0 +1,33 @@
+import primesense.openni2 as oni
+import numpy as np
+import registration
+from frames.source import FrameSource
+
+class OniSource(FrameSource):
+    '''
+    frame source reading an .oni recording by OpenNI playback
+    '''
+    
+    
+    def __init__(self, filename):
+        oni.initialize()
+        self.filename = filename
+        self.dev = oni.Device.open_file(filename)
+        
+        self.player = oni.PlaybackSupport(self.dev)
+        self.player.set_speed(-1)
+        self.depth_stream = self.dev.create_depth_stream()
+        self.clr_stream = self.dev.create_color_stream()
+        self.depth_stream.start()
+        self.clr_stream.start()
+        
+    def getNumberOfFrames(self):
+        return self.player.get_number_of_frames(self.depth_stream)
+    
+    def getFrame(self, frameIdx=-1):
+        ''' decode frame at index frameIdx '''
+        if frameIdx >= 0:
+            self.player.seek(self.depth_stream, frameIdx)
+        depth = self.depth_stream.read_frame()
+        depth = np.ctypeslib.as_array(depth.get_buffer_as_uint16())
+        return np.array(depth.reshape(registration.fullShape))
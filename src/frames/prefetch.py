@@ -0,0 +1,84 @@
+import threading
+import Queue
+import numpy as np
+
+class FramePrefetcher(object):
+    '''
+    class reading consecutive frames on a background thread into a ring
+    buffer of preallocated frames, so decoding overlaps with fitting
+
+    - read(frameIdx, seek, out) has to decode frame frameIdx into out,
+      seek is only True for the first frame after (re)starting
+    - a frame returned by get is valid until the next call of get
+    - non consecutive access restarts reading at the requested frame
+    '''
+
+
+    def __init__(self, read, nFrames, size=8, shape=(480, 640)):
+        self.read = read
+        self.nFrames = nFrames
+        self.buffers = [np.empty(shape, dtype=np.float32) for _ in range(size)]
+        self.thread = None
+        self.running = False
+        self.nextIdx = 0
+        self.current = None
+        self.free = None
+        self.ready = None
+
+    def start(self, frameIdx):
+        ''' (re)start reading at frame frameIdx '''
+        self.stop()
+        self.free = Queue.Queue()
+        for i in range(len(self.buffers)):
+            self.free.put(i)
+        self.ready = Queue.Queue()
+        self.current = None
+        self.nextIdx = frameIdx
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(frameIdx,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        ''' stop background thread, buffered frames are dropped '''
+        if self.thread is None:
+            return
+        self.running = False
+        self.free.put(None) # wake up thread waiting for a free buffer
+        self.thread.join()
+        self.thread = None
+
+    def run(self, frameIdx):
+        ''' background thread: fill free buffers with consecutive frames '''
+        seek = True
+        while frameIdx < self.nFrames:
+            slot = self.free.get()
+            if slot is None or not self.running:
+                return
+            try:
+                self.read(frameIdx, seek, self.buffers[slot])
+            except Exception as e:
+                self.ready.put((frameIdx, None, e))
+                return
+            self.ready.put((frameIdx, slot, None))
+            seek = False
+            frameIdx += 1
+        self.ready.put((frameIdx, None, IndexError("frame %d out of range" % frameIdx)))
+
+    def get(self, frameIdx=-1):
+        ''' return frame frameIdx (-1: next frame) '''
+        if frameIdx < 0:
+            frameIdx = self.nextIdx
+        if self.thread is None or frameIdx != self.nextIdx:
+            self.start(frameIdx)
+        if self.current is not None:
+            self.free.put(self.current)
+            self.current = None
+
+        idx, slot, error = self.ready.get()
+        if error is not None:
+            self.stop()
+            raise error
+        self.current = slot
+        self.nextIdx = idx + 1
+        return self.buffers[slot]
@@ -0,0 +1,48 @@
+import numpy as np
+import registration
+from frames.source import FrameSource
+
+class RawSource(FrameSource):
+    '''
+    frame source serving frames of a converted recording directly from a
+    memory-mapped file without decoding:
+    
+    - .npy: array (frames, 480, 640) of uint16, see convert
+    - .raw: consecutive uint16 frames (480, 640) without header
+    '''
+    
+    
+    def __init__(self, filename):
+        self.filename = filename
+        if filename.endswith('.npy'):
+            self.frames = np.load(filename, mmap_mode='r')
+        else:
+            self.frames = np.memmap(filename, dtype=np.uint16, mode='r')
+            self.frames = self.frames.reshape((-1,) + registration.fullShape)
+        self.nextIdx = 0
+        
+    def getNumberOfFrames(self):
+        return len(self.frames)
+    
+    def getFrame(self, frameIdx=-1):
+        ''' frame at index frameIdx (no copy) '''
+        if frameIdx < 0:
+            frameIdx = self.nextIdx
+        frameIdx = min(frameIdx, len(self.frames)-1) # end of recording: last frame
+        self.nextIdx = frameIdx + 1
+        return self.frames[frameIdx]
+    
+    def read(self, frameIdx, seek, out):
+        registration.downsample(self.frames[frameIdx], out)
+
+def convert(filename, rawFilename):
+    ''' convert an .oni recording once into a .npy file for RawSource '''
+    from frames.oniSource import OniSource
+    source = OniSource(filename)
+    n = source.getNumberOfFrames()
+    frames = np.lib.format.open_memmap(rawFilename, mode='w+', dtype=np.uint16,
+                                       shape=(n,) + registration.fullShape)
+    for i in range(n):
+        frames[i] = source.getFrame(0 if i == 0 else -1)
+    frames.flush()
+    del frames
@@ -0,0 +1,33 @@
+import registration
+
+class FrameSource(object):
+    '''
+    interface of a recording, depth frames are accessed by index:
+    
+    - getNumberOfFrames()
+    - getFrame(frameIdx): depth frame (uint16, full resolution),
+      frameIdx -1 reads the frame following the previous one
+    '''
+    
+    
+    def getNumberOfFrames(self):
+        raise NotImplementedError()
+    
+    def getFrame(self, frameIdx=-1):
+        raise NotImplementedError()
+    
+    def read(self, frameIdx, seek, out):
+        ''' read frame frameIdx into preallocated float32 frame out
+        (processing resolution), seek is False for consecutive frames
+        '''
+        registration.downsample(self.getFrame(frameIdx if seek else -1), out)
+
+def openSource(filename):
+    ''' frame source of a recording: .npy/.raw depth files are memory
+    mapped, everything else is opened by OpenNI
+    '''
+    if filename.endswith('.npy') or filename.endswith('.raw'):
+        from frames.rawSource import RawSource
+        return RawSource(filename)
+    from frames.oniSource import OniSource
+    return OniSource(filename)
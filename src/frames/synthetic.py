@@ -0,0 +1,134 @@
+import numpy as np
+import registration
+from frames.rawSource import RawSource
+
+class SyntheticSource(RawSource):
+    '''
+    frame source generating a synthetic recording with known ground truth
+    
+    - wall, torso and head behind a planar table (depth linear in x,y as
+      assumed by Table)
+    - both arms (shoulder, elbow, wrist) move along angle trajectories
+      (alpha, beta) as modeled by MotionFilter3D
+    - arm segments are rendered as round limbs whose front ridge is the
+      segment itself, hence truth gives the visible joint positions
+    - all frames are rendered once at full resolution (uint16)
+    '''
+    
+    
+    def __init__(self, nFrames=100, fps=30.0, noise=0.0, seed=0):
+        self.filename = None
+        self.nextIdx = 0
+        self.lengthUp = 280.0
+        self.lengthBot = 250.0
+        self.radius = 45.0
+        self.threshold = (500, 2400)
+        
+        t = np.arange(nFrames)/fps
+        self.truth = {}
+        for side, sign in [('Left', -1), ('Right', 1)]:
+            shoulder = np.asarray([sign*170.0, -120.0, 1450.0])
+            up = np.column_stack((np.pi/2 - sign*0.35 + 0.25*np.sin(2*np.pi*0.25*t),
+                                  -0.6 + 0.15*np.sin(2*np.pi*0.2*t + 1.0)))
+            bot = np.column_stack((np.pi/2 - sign*0.2 + 0.3*np.sin(2*np.pi*0.3*t + 0.5),
+                                   -1.1 + 0.2*np.sin(2*np.pi*0.25*t + 2.0)))
+            self.truth['shoulder'+side] = np.tile(shoulder, (nFrames, 1))
+            self.truth['elbow'+side] = shoulder + self.vector(up, self.lengthUp)
+            self.truth['wrist'+side] = self.truth['elbow'+side] + self.vector(bot, self.lengthBot)
+        self.head = np.asarray([0.0, -330.0, 1500.0])
+        
+        static = self.renderStatic()
+        rnd = np.random.RandomState(seed)
+        self.frames = np.empty((nFrames,) + registration.fullShape, dtype=np.uint16)
+        for i in range(nFrames):
+            depth = np.copy(static)
+            for side in ['Left', 'Right']:
+                self.drawSegment(depth, self.truth['shoulder'+side][i], self.truth['elbow'+side][i])
+                self.drawSegment(depth, self.truth['elbow'+side][i], self.truth['wrist'+side][i])
+            if noise > 0:
+                depth += rnd.normal(0, noise, depth.shape)
+            self.frames[i] = np.clip(np.rint(depth), 0, 4095)
+    
+    def vector(self, angles, r):
+        ''' vectors of length r with angles (alpha, beta) as MotionFilter3D '''
+        return r*np.column_stack((np.cos(angles[:, 0])*np.cos(angles[:, 1]),
+                                  np.sin(angles[:, 0])*np.cos(angles[:, 1]),
+                                  np.sin(angles[:, 1])))
+    
+    def project(self, pt):
+        ''' 3d-point to full resolution pixel (x,y) as float '''
+        K = registration.fullIntrinsic
+        return np.asarray([pt[0]*K[0, 0]/pt[2] + K[0, 2], pt[1]*K[1, 1]/pt[2] + K[1, 2]])
+    
+    def tableDepth(self, x, y):
+        ''' depth of the table at pixel (x,y) '''
+        return 1400.0 - (y - 300.0)*4.0 + (x - 320.0)*0.2
+    
+    def renderStatic(self):
+        ''' wall, torso, head and table '''
+        depth = np.full(registration.fullShape, 2800.0)
+        ys, xs = np.mgrid[0:registration.fullShape[0], 0:registration.fullShape[1]]
+        K = registration.fullIntrinsic
+        # torso
+        x1, y1 = self.project([-230.0, -230.0, 1500.0])
+        x2, y2 = self.project([230.0, 400.0, 1500.0])
+        depth[(xs >= x1) & (xs <= x2) & (ys >= y1) & (ys <= y2)] = 1500.0
+        # head
+        hx, hy = self.project(self.head)
+        r = 100.0*K[0, 0]/self.head[2]
+        depth[(xs - hx)**2 + (ys - hy)**2 <= r**2] = 1480.0
+        # table
+        table = (xs >= 60) & (xs <= 580) & (ys >= 300)
+        depth[table] = self.tableDepth(xs[table], ys[table])
+        return depth
+    
+    def drawSegment(self, depth, a, b):
+        ''' draw limb a-b (3d-points) into depth, nearest surface wins '''
+        K = registration.fullIntrinsic
+        pa = self.project(a)
+        pb = self.project(b)
+        r = self.radius*K[0, 0]/min(a[2], b[2])
+        x1 = int(max(min(pa[0], pb[0]) - r, 0))
+        y1 = int(max(min(pa[1], pb[1]) - r, 0))
+        x2 = int(min(max(pa[0], pb[0]) + r + 1, depth.shape[1]))
+        y2 = int(min(max(pa[1], pb[1]) + r + 1, depth.shape[0]))
+        if x2 <= x1 or y2 <= y1:
+            return
+        ys, xs = np.mgrid[y1:y2, x1:x2]
+        d = pb - pa
+        l2 = np.dot(d, d)
+        t = np.zeros(xs.shape) if l2 == 0 else np.clip(((xs - pa[0])*d[0] + (ys - pa[1])*d[1])/l2, 0, 1)
+        rho2 = (xs - pa[0] - t*d[0])**2 + (ys - pa[1] - t*d[1])**2
+        inside = rho2 <= r*r
+        z = a[2] + t*(b[2] - a[2])
+        z = z + self.radius - np.sqrt(np.maximum(self.radius**2 - rho2*(z/K[0, 0])**2, 0))
+        region = depth[y1:y2, x1:x2]
+        region[inside] = np.minimum(region[inside], z[inside])
+    
+    def getNumberOfFrames(self):
+        return len(self.frames)
+    
+    def pixel(self, pt):
+        ''' full resolution pixel (x,y,depth) of 3d-point in first frame '''
+        x, y = np.rint(self.project(pt)).astype(int)
+        return (x, y, float(self.frames[0, y, x]))
+    
+    def writeSetup(self, filename):
+        ''' setup file (see Prepare.saveSetup) for the first frame '''
+        with open(filename, 'w') as ifile:
+            ifile.write("threshold %d %d\n" % self.threshold)
+            for x, y in [(560, 470), (560, 310), (80, 310)]:
+                ifile.write("table %d %d %f\n" % (x, y, self.frames[0, y, x]))
+            ifile.write("posture %d %d %f\n" % self.pixel(self.head - [0, 0, 100.0]))
+            for joint in ['shoulderLeft', 'shoulderRight', 'elbowLeft', 'elbowRight',
+                          'wristLeft', 'wristRight']:
+                ifile.write("posture %d %d %f\n" % self.pixel(self.truth[joint][0]))
+    
+    def save(self, filename):
+        ''' save frames as .npy recording for RawSource '''
+        np.save(filename, self.frames)
+    
+    def error(self, frameIdx, states):
+        ''' distance (mm) of tracked states (dict joint: State) to truth '''
+        return dict((joint, np.linalg.norm(np.asarray(states[joint].pt, dtype=float) - self.truth[joint][frameIdx]))
+                    for joint in states)
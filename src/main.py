@@ -1,9 +1,52 @@
+import sys
+import timing
 from app import PyTrackerApp
 
+def parseOptions(argv):
+    ''' split arguments into positional arguments and options --name[=value] '''
+    args = [arg for arg in argv if not arg.startswith('--')]
+    options = dict((arg[2:].split('=', 1) + [''])[:2] for arg in argv if arg.startswith('--'))
+    return args, options
+
 def main():
-    app = PyTrackerApp(file)
-    app.prepare()
-    app.mainLoop()
+    # main.py file [setup|manual [scale [processes]]] [--timing[=trace]] [--realtime[=fps]] [--table=file]
+    #         [--margin[=px]]
+    argv, options = parseOptions(sys.argv)
+    if 'timing' in options:
+        # statistics of the stages, with trace also filename.trace.json
+        timing.enable(trace=options['timing'] == 'trace')
+    # processing resolution relative to VGA, e.g. 0.5 for QVGA
+    scale = float(argv[3]) if len(argv) > 3 else 1.0
+    # only the region around the arms (+ margin px, default 30) is preprocessed
+    margin = int(options['margin'] or 30) if 'margin' in options else None
+    app = PyTrackerApp(argv[1], scale, margin)
+    # table of an earlier session is reused, a new one is saved to it
+    tableFile = options.get('table') or None
+    if len(argv) > 2 and argv[2] == 'manual':
+        # thresholds and table set by hand
+        app.prepare(tableFile, auto=False)
+        app.resume() # labels of an interrupted session are kept
+        app.mainLoop()
+    elif len(argv) > 2:
+        # headless: use saved setup (filename.setup of an interactive run)
+        app.loadSetup(argv[2])
+        app.resume() # labels of an interrupted run are kept
+        if len(argv) > 4:
+            # skeleton frames calculated ahead by this number of processes
+            app.precompute(argv[2], int(argv[4]))
+        if 'realtime' in options:
+            # live-style: frames arrive at fps (default 30), fitting adapts to the time left
+            deadline = app.trackRealtime(float(options['realtime'] or 30.0))
+            deadline.report()
+        else:
+            fps = app.track()
+            print "tracked %s with %.1f frames/second" % (argv[1], fps)
+        print "too fast motions clamped:", ", ".join("%s %d" % item for item in sorted(app.skeleton.clamped().items()))
+        app.saveSmoothed()
+    else:
+        app.prepare(tableFile)
+        app.resume()
+        app.mainLoop()
 
 if __name__ == '__main__':
     main()
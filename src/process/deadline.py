@@ -0,0 +1,96 @@
+import time
+import numpy as np
+
+class Clock(object):
+    ''' wall clock '''
+    
+    
+    def now(self):
+        return time.time()
+    
+    def sleep(self, duration):
+        time.sleep(duration)
+
+class SimulatedClock(object):
+    '''
+    clock for reproducible real-time runs: time only advances by sleep
+    and by tick for every reading (simulated processing cost)
+    '''
+    
+    
+    def __init__(self, tick=0.0):
+        self.time = 0.0
+        self.tick = tick
+        
+    def now(self):
+        self.time += self.tick
+        return self.time
+    
+    def sleep(self, duration):
+        self.time += duration
+
+class Deadline(object):
+    '''
+    class to keep the latency budget of a frame in real-time tracking
+    
+    - the budget is shared by the fit parts of a frame, a part gets
+      the remaining time divided by the parts left
+    - a part with less than its fair share searches a smaller window
+      (not smaller than the motion predicted by the velocity allows)
+      and subsamples candidates, out of time it keeps the prediction
+    - counts degraded and predicted parts and late frames
+    '''
+    
+    
+    def __init__(self, budget, clock=None, parts=4, minWindow=2):
+        self.budget = budget
+        self.clock = Clock() if clock is None else clock
+        self.parts = parts
+        self.minWindow = minWindow
+        self.begin = 0.0
+        self.partsLeft = parts
+        self.frames = 0
+        self.late = 0
+        self.degraded = 0
+        self.predicted = 0
+        
+    def start(self, begin=None):
+        ''' start budget of a new frame (at begin, default: now) '''
+        self.begin = self.clock.now() if begin is None else begin
+        self.partsLeft = self.parts
+        self.frames += 1
+        
+    def finish(self):
+        ''' end of frame, counted as late if budget is exceeded '''
+        if self.remaining() < 0:
+            self.late += 1
+        
+    def remaining(self):
+        return self.budget - (self.clock.now() - self.begin)
+    
+    def plan(self, maxWindow, speed):
+        ''' window half size and candidate step for the next fit part,
+        speed: predicted motion in px per frame
+        
+        returns (0, 1) if out of time: keep prediction
+        '''
+        remaining = self.remaining()
+        parts = self.partsLeft
+        self.partsLeft = max(self.partsLeft - 1, 1)
+        if remaining <= 0:
+            self.predicted += 1
+            return 0, 1
+        ratio = (remaining/parts)/(self.budget/self.parts)
+        if ratio >= 1:
+            return maxWindow, 1
+        needed = min(maxWindow, self.minWindow + int(np.ceil(speed)))
+        affordable = int(np.ceil(maxWindow*ratio))
+        window = min(maxWindow, max(needed, affordable))
+        step = 1 if affordable >= needed else 2
+        if window < maxWindow or step > 1:
+            self.degraded += 1
+        return window, step
+    
+    def report(self):
+        print "%d frames, %d late, %d fits degraded, %d fits predicted" % (self.frames, self.late,
+                                                                        self.degraded, self.predicted)
@@ -1,30 +1,135 @@
 import numpy as np
 
+def formatRows(rows):
+    ''' text of label rows (one frame per row, all values as %f) '''
+    line = "%f " * rows.shape[1] + "\n"
+    return "".join(line % tuple(r) for r in rows)
+
 class StateHistory(object):
     '''
     container to hold history states and be able to dump them
+
+    - states of all frames in one array (frames x joints x [pt, angle, v])
+    - a frame is valid, if all joints of this frame are tracked
+    - tracked: first frame which is not tracked yet (high-water mark)
+    - stale: invalidated frames whose states are kept in order to stop
+      re-tracking as soon as new states reconverge with them
+    - dirty: first frame whose states changed since the last save (see
+      HistoryWriter), len(self) if none, storing the same states again
+      does not change it
     '''
 
 
-    def __init__(self):
-        joints = ['elbowLeft', 'elbowRight',
-                  'wristLeft', 'wristRight']
-        self.states = dict((el,[]) for el in joints)
-        
+    def __init__(self, nFrames=0):
+        self.joints = ['elbowLeft', 'elbowRight',
+                       'wristLeft', 'wristRight']
+        self.fields = [('pt', 3), ('angle', 2), ('v', 2)]
+        self.data = np.zeros((nFrames, len(self.joints), 7))
+        self.valid = np.zeros(nFrames, dtype=bool)
+        self.stale = np.zeros(nFrames, dtype=bool)
+        self.tracked = 0
+        self.dirty = nFrames
+
+    def __len__(self):
+        return len(self.valid)
+
+    def has(self, frameIdx):
+        ''' True if states of frame frameIdx are stored '''
+        return self.valid[frameIdx]
+
+    def get(self, frameIdx, joint):
+        ''' State of joint at frame frameIdx '''
+        row = self.data[frameIdx, self.joints.index(joint)]
+        return State(row[:3].copy(), row[3:5].copy(), row[5:7].copy())
+
+    def set(self, frameIdx, states):
+        ''' store states (dict joint: State) of frame frameIdx '''
+        previous = self.data[frameIdx].copy()
+        for j, joint in enumerate(self.joints):
+            st = states[joint]
+            self.data[frameIdx, j, :3] = st.pt
+            self.data[frameIdx, j, 3:5] = st.angle
+            self.data[frameIdx, j, 5:7] = st.v
+        self.valid[frameIdx] = True
+        self.stale[frameIdx] = False
+        if not np.array_equal(previous, self.data[frameIdx]):
+            self.dirty = min(self.dirty, frameIdx)
+        while self.tracked < len(self.valid) and self.valid[self.tracked]:
+            self.tracked += 1
+
+    def setFrames(self, frameIdx, data):
+        ''' store states data (frames x joints x [pt, angle, v]) of
+        consecutive frames from frameIdx on
+        '''
+        self.data[frameIdx:frameIdx+len(data)] = data
+        self.valid[frameIdx:frameIdx+len(data)] = True
+        self.stale[frameIdx:frameIdx+len(data)] = False
+        self.dirty = min(self.dirty, frameIdx)
+        while self.tracked < len(self.valid) and self.valid[self.tracked]:
+            self.tracked += 1
+
+    def invalidate(self, frameIdx, keep=False):
+        ''' delete states of frame frameIdx and all consecutive frames,
+        with keep they are kept as stale states
+        '''
+        if keep:
+            self.stale[frameIdx:] |= self.valid[frameIdx:]
+        else:
+            self.stale[frameIdx:] = False
+            self.dirty = min(self.dirty, frameIdx)
+        self.valid[frameIdx:] = False
+        self.tracked = min(self.tracked, frameIdx)
+
+    def reconverged(self, frameIdx, states, tolerance):
+        ''' True if all joints of states (dict joint: State) are within
+        tolerance (mm) of the stale states of frame frameIdx
+        '''
+        if not self.stale[frameIdx]:
+            return False
+        pts = np.asarray([states[joint].pt for joint in self.joints], dtype=float)
+        dist = np.sqrt(np.sum((pts - self.data[frameIdx, :, :3])**2, axis=1))
+        return np.max(dist) <= tolerance
+
+    def restore(self, frameIdx):
+        ''' stale states from frame frameIdx on are valid again (until
+        the first frame which was not stored)
+
+        returns number of restored frames
+        '''
+        end = frameIdx
+        while end < len(self.stale) and self.stale[end]:
+            end += 1
+        self.valid[frameIdx:end] = True
+        self.stale[frameIdx:end] = False
+        self.dirty = min(self.dirty, frameIdx)
+        while self.tracked < len(self.valid) and self.valid[self.tracked]:
+            self.tracked += 1
+        return end - frameIdx
+
+    def rows(self, first, end):
+        ''' states of frames first..end-1, one row per frame '''
+        return self.data[first:end].reshape(end - first, self.data.shape[1]*self.data.shape[2])
+
+    def stored(self):
+        ''' number of leading frames whose states are stored (valid or stale) '''
+        kept = self.valid | self.stale
+        return len(kept) if np.all(kept) else int(np.argmin(kept))
+
+    def recordType(self):
+        ''' structured type of one frame: pt, angle, v of every joint '''
+        return np.dtype([(joint, [(name, float, n) for name, n in self.fields])
+                         for joint in self.joints])
+
+    def records(self):
+        ''' stored frames (see stored) as structured array (no copy) '''
+        n = self.stored()
+        return self.rows(0, n).view(self.recordType()).reshape(n)
+
     def dump(self):
-        keys = self.states.keys()
-        l = len(self.states[keys[0]])
-        line = ""
-        for i in range(l):
-            if self.states[keys[0]][i] is None:
-                break
-            for x in keys:
-                st = self.states[x]
-                line += " ".join(np.char.mod("%f", st[i].pt))+" "
-                line += " ".join(np.char.mod("%f", st[i].angle))+" "
-                line += " ".join(np.char.mod("%f", st[i].v)) + " "
-            line += "\n"
-        return line
+        ''' text of the stored frames (see stored), stale frames of a
+        re-tracking are kept until they are replaced
+        '''
+        return formatRows(self.rows(0, self.stored()))
         
 class State(object):
     ''' 
@@ -1,6 +1,7 @@
 import numpy as np
 import registration
-from motion import MotionFilter3D
+import timing
+from motion import MotionFilter3D, MotionFilterBank
 from process.history import State
 
 class Skeleton(object):
@@ -11,6 +12,7 @@ class Skeleton(object):
     - in order to fit a new position, frame has to be transformed to a binary
       distance transformation (skeleton of frame)
     - occlusions only partly supported
+    - with a deadline (real-time mode) the search adapts to the time left
     '''
     
     
@@ -23,17 +25,40 @@ class Skeleton(object):
         self.initState = len(self.states)-1 #countdown for each part until zero
         self.fullStates = {}
         self.depth = None
+        self.world = None
         
         self.lengthUp = 0
         self.lengthBot = 0
         self.mf = {}
+        self.bank = MotionFilterBank()
+        self.points = []
+        self.deadline = None
     
+    @property
+    def depth(self):
+        return self._depth
+
+    @depth.setter
+    def depth(self, depth):
+        ''' new frame: point cloud of previous frame is invalid '''
+        self._depth = depth
+        self.world = None
+
+    def getWorld(self):
+        ''' point cloud (h,w,3) of current depth frame,
+        calculated once per frame and shared by all fitPart calls
+        '''
+        if self.world is None:
+            self.world = registration.get3DworldImage(self.depth)
+        return self.world
+
     def setPoint(self, pt):
         ''' interface function: set a point for class (x,y,z)
         
         set initial positions for every joint, left and right,
         occlusions are not supported
         '''
+        self.points.append(pt)
         self.states[self.joints[self.initState]] = pt
         
         if self.initState == 0:
@@ -53,13 +78,14 @@ class Skeleton(object):
             self.lengthBot = np.mean(lengthBot)
             self.lengthUp = np.mean(lengthUp)
             
+            self.bank = MotionFilterBank()
             for side in ['Left', 'Right']:
                 self.mf['shoulder'+side+"-elbow"+side] = MotionFilter3D(registration.point2world(self.states['elbow'+side]),
                                                                         registration.point2world(self.states['shoulder'+side]), 
-                                                                        self.lengthUp, self.lengthBot)
+                                                                        self.lengthUp, self.lengthBot, self.bank)
                 self.mf['elbow'+side+"-wrist"+side] = MotionFilter3D(registration.point2world(self.states['wrist'+side]),
                                                                      registration.point2world(self.states['elbow'+side]),
-                                                                     self.lengthBot)
+                                                                     self.lengthBot, bank=self.bank)
                 self.fullStates['elbow'+side] = State(registration.point2world(self.states['elbow'+side]),
                                       self.mf['shoulder'+side+'-elbow'+side].state,
                                       self.mf['shoulder'+side+'-elbow'+side].v)
@@ -84,16 +110,21 @@ class Skeleton(object):
         ''' with the help of adjusted frame 'skeleton' new joint position
         are obtained
         '''
-        self.fitPart(skeleton, 'shoulderLeft', 'elbowLeft', 'wristLeft')
-        self.fitPart(skeleton, 'elbowLeft', 'wristLeft')
-        self.fitPart(skeleton, 'shoulderRight', 'elbowRight', 'wristRight')
-        self.fitPart(skeleton, 'elbowRight', 'wristRight')
+        self.fitArm(skeleton, 'Left')
+        self.fitArm(skeleton, 'Right')
+        
+    def fitArm(self, skeleton, side):
+        ''' fit elbow and wrist of one side ('Left' or 'Right') '''
+        with timing.stage("fitPart shoulder%s-elbow%s" % (side, side)):
+            self.fitPart(skeleton, 'shoulder'+side, 'elbow'+side, 'wrist'+side)
+        with timing.stage("fitPart elbow%s-wrist%s" % (side, side)):
+            self.fitPart(skeleton, 'elbow'+side, 'wrist'+side)
         
 #        self.fitPart('elbowLeft', 'wristLeft', skeleton)
         
     def fitPart(self, skeleton, fixPart, loosePart, nextPart = None):
         ''' fit one point, if this has successor, it is also adjusted '''
-        localSkeleton = np.copy(skeleton)
+        mf = self.mf[fixPart+"-"+loosePart]
         ###### predeccesor ######
         fix = self.states[fixPart]
         fixWorld  = np.asarray(registration.point2world(fix))
@@ -103,55 +134,90 @@ class Skeleton(object):
             nextPoint = registration.point2world(self.states[nextPart])
             
         ###### interpolated new point ######
-        futurePoint = self.mf[fixPart+"-"+loosePart].predict(fixWorld)
+        futurePoint = mf.predict(fixWorld)
         ###### observed new point ######
         nowPoint = registration.point2world(self.states[loosePart])
         
-        localSkeleton[np.abs(self.depth-nowPoint[2])>100] = 0 # limit search space: only points +- 10cm
-        world = registration.get3Dworld(self.depth)[0]
-        world = world.T.reshape((480,640,3))
-        
         ###### window parameters ######
         # new point has to be in a 
-        # window (+-10px) as interpolated
-        # new point
+        # window (+-10px at VGA) as
+        # interpolated new point
+        w = max(1, int(np.round(10*registration.scale)))
+        step = 1
+        if self.deadline is not None:
+            speed = mf.r*np.max(np.abs(mf.v))*registration.depthFX/futurePoint[2]
+            w, step = self.deadline.plan(w, speed)
         x = int(np.round( futurePoint[0]*registration.depthFX/futurePoint[2] + registration.depthCX))
         y = int(np.round( futurePoint[1]*registration.depthFY/futurePoint[2] + registration.depthCY))
         z = futurePoint[2]
-        x1=np.max((int(np.round(x)), fix[0])) + 10
-        x2=np.min((int(np.round(x)), fix[0])) - 10
-        y1=np.max((int(np.round(y)), fix[1])) + 10
-        y2=np.min((int(np.round(y)), fix[1])) - 10
+        x1=np.max((int(np.round(x)), fix[0])) + w
+        x2=np.min((int(np.round(x)), fix[0])) - w
+        y1=np.max((int(np.round(y)), fix[1])) + w
+        y2=np.min((int(np.round(y)), fix[1])) - w
         
-        ###### find best candidate ######
-        # by using fitting linear function
-        # and minimizing the distance
-        candidates = world[y-10:y+10, x-10:x+10][np.where(localSkeleton[y-10:y+10, x-10:x+10])]
-        if len(candidates) != 0:
-            what2Fit= world[y2:y1, x2:x1][np.where(localSkeleton[y2:y1, x2:x1])]
-            fitFaktor = np.zeros(candidates.shape[0])
-            for i, c in enumerate(candidates):
-                u = c - fixWorld
-                d = np.cross((what2Fit - fixWorld), u)
-                d = np.sqrt(np.sum(d**2, axis=1))/np.linalg.norm(u)
-                fitFaktor[i] = np.sqrt(np.sum(d**2))
-            
-            bestFit = candidates[np.argmin(fitFaktor)]
-            bestFit = self.mf[fixPart+"-"+loosePart].update(bestFit, fixWorld)
+        if w == 0:
+            ###### out of time: keep predicted motion ######
+            bestFit = mf.update(futurePoint, fixWorld)
             x,y = registration.world2point(bestFit)
             z = bestFit[2]
+        else:
+            world = self.getWorld()
+            
+            ###### find best candidate ######
+            # by using fitting linear function
+            # and minimizing the distance
+            window = (slice(y-w, y+w, step), slice(x-w, x+w, step))
+            candidates = world[window][self.localSkeleton(skeleton, window, nowPoint[2])]
+            if len(candidates) != 0:
+                region = (slice(y2, y1), slice(x2, x1))
+                what2Fit= world[region][self.localSkeleton(skeleton, region, nowPoint[2])]
+                fitFaktor = self.scoreCandidates(candidates, what2Fit, fixWorld)
+                
+                bestFit = candidates[np.argmin(fitFaktor)]
+                with timing.stage("MotionFilter3D.update"):
+                    bestFit = mf.update(bestFit, fixWorld)
+                x,y = registration.world2point(bestFit)
+                z = bestFit[2]
         
         ###### adjust successor point ######
         if nextPoint is not None:
-            nextPoint = self.mf[fixPart+"-"+loosePart].project(nextPoint, fixWorld)
+            nextPoint = mf.project(nextPoint, fixWorld)
             a, b = registration.world2point(nextPoint)
             self.states[nextPart] = (a, b, nextPoint[2])
             
         self.states[loosePart] = (x, y, z)
         self.fullStates[loosePart] = State(registration.point2world(self.states[loosePart]),
-                                           self.mf[fixPart+"-"+loosePart].state,
-                                           self.mf[fixPart+"-"+loosePart].v)
+                                           mf.state,
+                                           mf.v)
               
+    def localSkeleton(self, skeleton, region, z):
+        ''' skeleton pixels of region (tuple of slices) limiting the
+        search space: only points +- 10cm to depth z, only the region
+        is masked, the frames are not written
+        '''
+        return (skeleton[region] != 0) & (np.abs(self.depth[region]-z) <= 100)
+    
+    def scoreCandidates(self, candidates, what2Fit, anchor):
+        ''' score of every candidate: sum of squared distances of what2Fit
+        to the line anchor-candidate (smaller is better)
+
+        |p x u|^2 = |p|^2 |u|^2 - (p.u)^2, summed over all points p this
+        only needs sum |p|^2 and the scatter matrix of p, so all candidates
+        are scored at once without iterating over them
+        '''
+        p = what2Fit - anchor
+        u = candidates - anchor
+        scatter = np.dot(p.T, p)
+        uu = np.sum(u**2, axis=1)
+        return np.sum(p**2) - np.sum(np.dot(u, scatter)*u, axis=1)/uu
+
+    def clamped(self):
+        ''' number of too fast motions clamped by the motion filters
+        (see MotionFilterBank) per segment
+        '''
+        return dict((key, int(np.sum(self.bank.clamped[mf.idx]))) for key, mf in self.mf.items())
+
     def reset(self):
         ''' reset states '''
-        self.initState = len(self.states)-1
\ No newline at end of file
+        self.initState = len(self.states)-1
+        self.points = []
\ No newline at end of file
@@ -1,78 +1,131 @@
 import numpy as np
 
+def getAngles(vec):
+    ''' angles (alpha, beta) of vectors vec (n,3) '''
+    alpha = np.arctan2(vec[:, 1], vec[:, 0])
+    norm = np.sqrt(vec[:, 0]**2 + vec[:, 1]**2)
+    beta = np.arctan2(vec[:, 2], np.where(norm==0, 42, norm))
+    return np.column_stack((alpha, beta))
+
+def getVectors(angles, r):
+    ''' vectors of lengths r (n) with angles (alpha, beta) (n,2) '''
+    return r[:, np.newaxis]*np.column_stack((np.cos(angles[:, 0])*np.cos(angles[:, 1]),
+                                             np.sin(angles[:, 0])*np.cos(angles[:, 1]),
+                                             np.sin(angles[:, 1])))
+
+def wrap(angles):
+    ''' wrap angles once into [-pi, pi] '''
+    return angles - 2*np.pi*(angles > np.pi) + 2*np.pi*(angles < -np.pi)
+
+class MotionFilterBank(object):
+    '''
+    class to model motion of all segments at once
+    
+    - angle state (alpha, beta), velocity v and length r of every
+      segment in shared arrays
+    - update, predict and project work on arrays of segment indices
+    - velocities exceeding vMax are clamped and counted in clamped
+    '''
+    
+    
+    def __init__(self):
+        self.vMax = np.asarray([80.0, 80.0])*np.pi/180.0
+        self.state = np.zeros((0, 2))
+        self.v = np.zeros((0, 2))
+        self.r = np.zeros(0)
+        self.clamped = np.zeros((0, 2), dtype=int)
+        
+    def add(self, initState, initAnchor, length):
+        ''' add segment anchor-state, returns its index '''
+        vec = np.asarray(initState, dtype=float).reshape((1, 3)) - np.asarray(initAnchor, dtype=float).reshape((1, 3))
+        self.state = np.vstack((self.state, getAngles(vec)))
+        self.v = np.vstack((self.v, np.zeros((1, 2))))
+        self.r = np.append(self.r, length)
+        self.clamped = np.vstack((self.clamped, np.zeros((1, 2), dtype=int)))
+        return len(self.r) - 1
+    
+    def update(self, idx, points, anchors):
+        ''' update states of segments idx by new observations points (n,3) '''
+        nowState = getAngles(points - anchors)
+        nowV = wrap(nowState - self.state[idx])
+        fast = np.abs(nowV) >= self.vMax
+        self.clamped[idx] += fast
+        nowV = np.clip(nowV, -self.vMax, self.vMax)
+        self.v[idx] = (nowV + self.v[idx])/2.0
+        self.state[idx] = wrap(self.state[idx] + self.v[idx])
+        return anchors + getVectors(self.state[idx], self.r[idx])
+    
+    def predict(self, idx, anchors):
+        ''' with the help of current state v, the positions of next frame
+        joints are returned '''
+        return anchors + getVectors(self.state[idx] + self.v[idx], self.r[idx])
+    
+    def project(self, idx, points, anchors):
+        ''' project points to new positions if anchors
+        have changed previously
+        '''
+        vec = points - anchors
+        r = np.sqrt(np.sum(vec**2, axis=1))
+        return anchors + getVectors(getAngles(vec) + self.v[idx], r)
+
 class MotionFilter3D(object):
     '''
     class to model motion of a joint
     
     - using angles alpha and beta to describe motion
     - linear change of these angles assumed
+    - state is kept as one segment of a MotionFilterBank
     '''
     
     
-    def __init__(self, initState, initAnchor, length, length2=None):
-        self.vMax = np.asarray([80.0, 80.0])*np.pi/180.0
-        vec = np.asarray(initState) - np.asarray(initAnchor)
-        self.state  = np.asarray(self.getAngles(vec))
-        self.v = np.array([0,0])
-        self.r = length
+    def __init__(self, initState, initAnchor, length, length2=None, bank=None):
+        self.bank = MotionFilterBank() if bank is None else bank
+        self.idx = self.bank.add(initState, initAnchor, length)
+        
+    @property
+    def state(self):
+        return self.bank.state[self.idx].copy()
+    
+    @state.setter
+    def state(self, state):
+        self.bank.state[self.idx] = state
+        
+    @property
+    def v(self):
+        return self.bank.v[self.idx].copy()
+    
+    @v.setter
+    def v(self, v):
+        self.bank.v[self.idx] = v
+    
+    @property
+    def r(self):
+        return self.bank.r[self.idx]
+    
+    @property
+    def vMax(self):
+        return self.bank.vMax
     
     def update(self, point, anchor):
         ''' update current state (alpha, beta, v) by new observation 'point' '''
-        nowVec = np.array(point).reshape(-1)-np.array(anchor).reshape(-1)
-        nowState = np.asarray(self.getAngles(nowVec))
-        
-        nowV = nowState-self.state
-        for i in range(len(nowV)):
-            if nowV[i] > np.pi:
-                nowV[i] -= 2*np.pi
-            elif nowV[i] < -np.pi:
-                nowV[i] += 2*np.pi
-        
-        for i in range(len(nowV)):
-            if np.abs(nowV[i]) >= self.vMax[i]:
-                print "too fast", i
-                print "before", nowV[i]*180.0/np.pi
-                nowV[i] = self.vMax[i] * np.abs(nowV[i])/nowV[i]
-                print "after", nowV[i]*180.0/np.pi
-        self.v = (nowV+ self.v)/2.0
-        self.state = self.state + self.v
-        
-        for i in range(len(self.state)):
-            if self.state[i] > np.pi:
-                self.state[i] -= 2*np.pi
-            elif self.state[i] < -np.pi:
-                self.state[i] += 2*np.pi
-        
-        ret =  np.asarray( [self.r*np.cos(self.state[0])*np.cos(self.state[1]),
-                            self.r*np.sin(self.state[0])*np.cos(self.state[1]),
-                            self.r*np.sin(self.state[1])] )
-        return anchor + ret
+        anchor = np.asarray(anchor, dtype=float).reshape((1, 3))
+        point = np.asarray(point, dtype=float).reshape((1, 3))
+        return self.bank.update([self.idx], point, anchor)[0]
     
     def predict(self, anchor):
         ''' with the help of current state v, the position of next frame joint
         is returned '''
-        
-        state = self.state + self.v
-        ret =  np.asarray( [self.r*np.cos(state[0])*np.cos(state[1]),
-                self.r*np.sin(state[0])*np.cos(state[1]),
-                self.r*np.sin(state[1])] )
-        return anchor + ret
+        anchor = np.asarray(anchor, dtype=float).reshape((1, 3))
+        return self.bank.predict([self.idx], anchor)[0]
     
     def project(self, point, anchor):
         ''' project point to new position if anchor
         has changed previously
         '''
-        vec = point-anchor
-        r = np.linalg.norm(vec)
-        a = np.asarray(self.getAngles(vec)) +self.v
-        ret =  np.asarray( [r*np.cos(a[0])*np.cos(a[1]),
-                            r*np.sin(a[0])*np.cos(a[1]),
-                            r*np.sin(a[1])] )
-        return anchor + ret
+        anchor = np.asarray(anchor, dtype=float).reshape((1, 3))
+        point = np.asarray(point, dtype=float).reshape((1, 3))
+        return self.bank.project([self.idx], point, anchor)[0]
     
     def getAngles(self, vec):
         ''' calculate angles of vec (alpha, beta) '''
-        alpha = np.arctan2(vec[1], vec[0])
-        norm = np.linalg.norm(vec[:2])
-        beta = np.arctan2(vec[2], 42) if norm==0 else np.arctan2(vec[2], norm) 
-        return alpha, beta
\ No newline at end of file
+        return tuple(getAngles(np.asarray(vec, dtype=float).reshape((1, 3)))[0])
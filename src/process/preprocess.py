@@ -0,0 +1,118 @@
+import cv2
+import cv2.cv as cv
+import numpy as np
+import registration
+
+class Preprocessing(object):
+    '''
+    class to transform a filtered depth frame into the binary distance
+    transformation (skeleton of frame) fitted by Skeleton.fit
+    
+    - normalization, canny, distance transformation, adaptive threshold
+    - buffers are allocated once and reused for every frame
+    - optionally only a region around the given joints (+ margin) is
+      processed, the rest of the skeleton frame is empty
+    '''
+    
+    
+    def __init__(self, cannyBot=15, cannyTop=30, margin=None):
+        self.cannyBot = cannyBot
+        self.cannyTop = cannyTop
+        self.margin = margin
+        self.scratch = {}
+        self.outputs = None
+        self.edge = None
+        self.skeleton = None
+        
+    def getBuffers(self, shape):
+        ''' buffers for frames of given shape: contiguous views on scratch
+        buffers of frame size, which are only allocated for larger frames,
+        so regions of any shape reuse them
+        '''
+        size = shape[0]*shape[1]
+        if self.scratch.get('float', np.empty(0)).size < size:
+            size = max(size, registration.shape[0]*registration.shape[1])
+            self.scratch = {'depth': np.empty(size, dtype=np.float32),
+                            'mask': np.empty(size, dtype=np.float32),
+                            'float': np.empty(size, dtype=np.float32),
+                            'norm': np.empty(size, dtype=np.uint8),
+                            'edge': np.empty(size, dtype=np.uint8),
+                            'inv': np.empty(size, dtype=np.uint8),
+                            'dist': np.empty(size, dtype=np.float32),
+                            'dist8': np.empty(size, dtype=np.uint8),
+                            'skeleton': np.empty(size, dtype=np.uint8)}
+        n = shape[0]*shape[1]
+        return dict((k, v[:n].reshape(shape)) for k, v in self.scratch.items())
+    
+    def getOutputs(self, shape):
+        ''' skeleton and edge frame of region processing '''
+        if self.outputs is None or self.outputs['skeleton'].shape != shape:
+            self.outputs = {'edge': np.empty(shape, dtype=np.uint8),
+                            'skeleton': np.empty(shape, dtype=np.uint8)}
+        return self.outputs
+    
+    def normalize(self, depth, b):
+        ''' depth to uint8 frame 'norm' '''
+        f = b['float']
+        np.divide(depth, np.max(depth)-np.min(depth), f)
+        f -= np.min(depth)
+        f *= 255.
+        np.rint(f, f)
+        np.copyto(b['norm'], f, casting='unsafe')
+        
+    def canny(self, depth, mask, b):
+        ''' edge frame of depth, where mask is zero edges are set '''
+        self.normalize(depth, b)
+        cv2.Canny(b['norm'], self.cannyBot, self.cannyTop, b['edge'])
+        if mask is not None:
+            b['edge'][mask==0] = 255
+        return b['edge']
+    
+    def edges(self, depth, mask=None):
+        ''' edge frame of whole depth frame '''
+        return self.canny(depth, mask, self.getBuffers(depth.shape))
+    
+    def run(self, depth, mask, b):
+        ''' whole chain on depth, result in 'skeleton' '''
+        self.canny(depth, mask, b)
+        cv2.bitwise_not(b['edge'], b['inv'])
+        cv2.distanceTransform(b['inv'], cv.CV_DIST_L2, 3, b['dist'])
+        f = b['float']
+        np.divide(b['dist'], np.max(b['dist']), f)
+        f *= 255.0
+        np.rint(f, f)
+        np.copyto(b['dist8'], f, casting='unsafe')
+        cv2.adaptiveThreshold(b['dist8'], 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 13, 0, b['skeleton'])
+        return b['skeleton']
+    
+    def region(self, points, shape):
+        ''' bounding box (x1, y1, x2, y2) of points (x,y,..) plus margin '''
+        pts = np.asarray([pt[:2] for pt in points], dtype=int)
+        x1, y1 = np.maximum(np.min(pts, axis=0) - self.margin, 0)
+        x2, y2 = np.minimum(np.max(pts, axis=0) + self.margin + 1, shape[::-1])
+        return x1, y1, x2, y2
+    
+    def apply(self, depth, mask, points=None):
+        ''' skeleton frame of filtered depth frame and threshold mask,
+        with margin set, only the region around points is processed
+        
+        returns skeleton frame, edge frame is kept in edge
+        '''
+        if self.margin is None or points is None:
+            b = self.getBuffers(depth.shape)
+            self.run(depth, mask, b)
+        else:
+            x1, y1, x2, y2 = self.region(points, depth.shape)
+            b = self.getOutputs(depth.shape)
+            b['skeleton'][:] = 0
+            b['edge'][:] = 255
+            if x2 > x1 and y2 > y1:
+                part = self.getBuffers((y2 - y1, x2 - x1))
+                np.copyto(part['depth'], depth[y1:y2, x1:x2])
+                np.copyto(part['mask'], mask[y1:y2, x1:x2])
+                self.run(part['depth'], part['mask'], part)
+                b['skeleton'][y1:y2, x1:x2] = part['skeleton']
+                b['edge'][y1:y2, x1:x2] = part['edge']
+        self.edge = b['edge']
+        self.skeleton = b['skeleton']
+        return self.skeleton
@@ -0,0 +1,86 @@
+import numpy as np
+import registration
+from motion import getVectors
+from process.history import StateHistory
+
+def smoothAngles(angles, sigma, acceleration):
+    ''' forward-backward (Rauch-Tung-Striebel) smoother of a constant
+    velocity model for every channel of angles (frames, channels) at once,
+    sigma: measurement noise (channels), acceleration: process noise (rad
+    per frame^2), angles have to be unwrapped
+    
+    returns smoothed angles and velocities (frames, channels)
+    '''
+    n = len(angles)
+    r = sigma**2
+    q = acceleration**2
+    ###### forward: kalman filter ######
+    # covariance [[p00, p01], [p01, p11]] kept per channel
+    a = np.copy(angles[0])
+    v = np.zeros_like(a)
+    p00, p01, p11 = r*np.ones_like(a), np.zeros_like(a), np.ones_like(a)
+    filtered = np.empty((n, 2) + a.shape)
+    predicted = np.empty((n, 2) + a.shape)
+    covF = np.empty((n, 3) + a.shape)
+    covP = np.empty((n, 3) + a.shape)
+    for i in range(n):
+        if i > 0:
+            a = a + v
+            p00, p01, p11 = p00 + 2*p01 + p11 + q/4, p01 + p11 + q/2, p11 + q
+        predicted[i] = a, v
+        covP[i] = p00, p01, p11
+        s = p00 + r
+        k0, k1 = p00/s, p01/s
+        e = angles[i] - a
+        a, v = a + k0*e, v + k1*e
+        p00, p01, p11 = (1 - k0)*p00, (1 - k0)*p01, p11 - k1*p01
+        filtered[i] = a, v
+        covF[i] = p00, p01, p11
+    
+    ###### backward: smoothed = filtered + C (smoothed' - predicted') ######
+    # C = P F^T inv(P'), F = [[1, 1], [0, 1]]
+    smoothed = np.empty_like(filtered)
+    smoothed[-1] = filtered[-1]
+    for i in range(n-2, -1, -1):
+        f00, f01, f11 = covF[i]
+        q00, q01, q11 = covP[i+1]
+        det = q00*q11 - q01**2
+        c00 = ((f00 + f01)*q11 - f01*q01)/det
+        c01 = (f01*q00 - (f00 + f01)*q01)/det
+        c10 = ((f01 + f11)*q11 - f11*q01)/det
+        c11 = (f11*q00 - (f01 + f11)*q01)/det
+        da, dv = smoothed[i+1] - predicted[i+1]
+        smoothed[i] = filtered[i, 0] + c00*da + c01*dv, filtered[i, 1] + c10*da + c11*dv
+    return smoothed[:, 0], smoothed[:, 1]
+
+def smoothHistory(history, skeleton, noise=10.0, acceleration=0.005):
+    ''' offline smoothing of all tracked frames of history (see StateHistory)
+    in angle space: angles of every segment are smoothed over the whole
+    recording (see smoothAngles) and joints are placed with the fixed segment
+    lengths of skeleton (lengthUp, lengthBot) starting at its shoulders
+    
+    noise: tracking noise of joint positions (mm)
+    
+    returns new StateHistory of smoothed states
+    '''
+    n = history.tracked
+    if n == 0:
+        return StateHistory(0)
+    lengths = np.asarray([skeleton.lengthUp if joint.startswith('elbow') else skeleton.lengthBot
+                          for joint in history.joints])
+    angles = np.unwrap(history.data[:n, :, 3:5], axis=0)
+    sigma = np.repeat(noise/lengths, 2).reshape(len(lengths), 2)
+    angles, v = smoothAngles(angles, sigma, acceleration)
+    
+    data = np.zeros((n,) + history.data.shape[1:])
+    data[:, :, 3:5] = np.mod(angles + np.pi, 2*np.pi) - np.pi
+    data[:, :, 5:7] = v
+    for side in ['Left', 'Right']:
+        elbow = history.joints.index('elbow'+side)
+        wrist = history.joints.index('wrist'+side)
+        shoulder = np.asarray(registration.point2world(skeleton.states['shoulder'+side]), dtype=float)
+        data[:, elbow, :3] = shoulder + getVectors(angles[:, elbow], np.full(n, skeleton.lengthUp))
+        data[:, wrist, :3] = data[:, elbow, :3] + getVectors(angles[:, wrist], np.full(n, skeleton.lengthBot))
+    smoothed = StateHistory(n)
+    smoothed.setFrames(0, data)
+    return smoothed
@@ -1,5 +1,6 @@
 import numpy as np
 import cv2
+import registration
 
 class Table(object):
     '''
@@ -8,6 +9,7 @@ class Table(object):
     - 3 points on the table are necessary
     - table assumed to be planar
     - to filter table, modeled table is subtracted from fram 
+    - the points can be detected automatically (see detect)
     '''
 
 
@@ -18,12 +20,17 @@ class Table(object):
         self.initState = 3
         self.depth = None
         self.table = None
+        self.points = []
+        self.diff = None
+        self.keep = None
+        self.out = None
     
     def setPoint(self, pt):
         ''' interface function: set a point for class (x,y,z)
         
         set three points of table: front right, depth right, depth left
         '''        
+        self.points.append(pt)
         if self.initState ==3:
             self.frontRight = np.asarray([pt[1], pt[0], pt[2]])
         elif self.initState ==2:
@@ -49,34 +56,124 @@ class Table(object):
     def calcTable(self):
         ''' model table according to the three sampled points
         
-        explanation see thesis
+        explanation see thesis: the table is a plane over the image, 
+        table(p) = front_z + g.(p - front) for pixels p inside the table polygon
         '''
-        self.table = np.zeros((480,640))
-        mask= np.zeros((480, 640), dtype=np.int8)
+        self.table = np.zeros(registration.shape)
+        mask= np.zeros(registration.shape, dtype=np.uint8)
         pts = np.asarray([self.frontRight[:2][::-1], 
                           self.depthRight[:2][::-1],
                           self.depthLeft[:2][::-1], 
                           self.frontRight[:2][::-1]+self.widthVec[:2][::-1]
-                        ])
-        cv2.fillConvexPoly(mask, pts.astype(int), 1)
-        
-        z = np.asarray(np.unravel_index(np.arange(640*480), (480, 640)))
-        z = z - np.tile(self.frontRight[:2], (z.shape[1], 1)).T
+                        ]).astype(int)
+        cv2.fillConvexPoly(mask, pts, 1)
         
         A = np.asarray([self.depthVec[:2]/np.linalg.norm(self.depthVec[:2]),
                         self.widthVec[:2]/np.linalg.norm(self.widthVec[:2])]).T
-        self.table = np.dot(np.linalg.inv(A), z)
-        self.table = self.table*np.tile([self.depthVec[2]/np.linalg.norm(self.depthVec[:2]), 
-                                         self.widthVec[2]/np.linalg.norm(self.widthVec[:2])],
-                                        (self.table.shape[1], 1)).T
-        self.table = (np.sum(self.table, axis=0).reshape((480,640)) + self.frontRight[2] )*mask
+        slope = np.asarray([self.depthVec[2]/np.linalg.norm(self.depthVec[:2]),
+                            self.widthVec[2]/np.linalg.norm(self.widthVec[:2])])
+        g = np.dot(np.linalg.inv(A).T, slope)
+        
+        ###### only bounding box of polygon ######
+        x1, y1 = np.maximum(np.min(pts, axis=0), 0)
+        x2, y2 = np.minimum(np.max(pts, axis=0) + 1, registration.shape[::-1])
+        if x2 <= x1 or y2 <= y1:
+            return
+        rows = np.arange(y1, y2, dtype=float)[:, np.newaxis] - self.frontRight[0]
+        cols = np.arange(x1, x2, dtype=float)[np.newaxis, :] - self.frontRight[1]
+        self.table[y1:y2, x1:x2] = (g[0]*rows + g[1]*cols + self.frontRight[2])*mask[y1:y2, x1:x2]
+    
+    def detect(self, depth, tolerance=15.0, minSlope=1.0, minFraction=0.1,
+               hypotheses=256, step=4, seed=0):
+        ''' detect the table in depth frame(s) (median of several frames is
+        more robust), the dominant plane depth = a*x + b*y + c of the same
+        model as calcTable is estimated by RANSAC with all hypotheses tested
+        at once on every step-th pixel, only planes approaching the camera
+        towards the bottom of the frame (b < -minSlope mm per VGA pixel)
+        are tables, this excludes walls and the patient
+        
+        the table corners are the bounding box of the rows and columns mostly
+        covered by inliers (+- tolerance mm), objects crossing the plane
+        only touch few of them
+        
+        returns fraction of sampled pixels on the table (confidence), the
+        table is only set if it is at least minFraction
+        '''
+        if depth.ndim == 3:
+            depth = np.median(depth, axis=0)
+        ys, xs = np.mgrid[0:depth.shape[0]:step, 0:depth.shape[1]:step]
+        z = depth[::step, ::step]
+        valid = z > 0
+        pts = np.column_stack((xs[valid], ys[valid], np.ones(np.count_nonzero(valid)), z[valid]))
+        if len(pts) < 3:
+            return 0.0
+        
+        ###### all hypotheses at once ######
+        rnd = np.random.RandomState(seed)
+        triples = pts[rnd.randint(0, len(pts), (hypotheses, 3))]
+        A = triples[:, :, :3]
+        ok = np.abs(np.linalg.det(A)) > 1e-6
+        planes = np.zeros((hypotheses, 3))
+        planes[ok] = np.linalg.solve(A[ok], triples[ok, :, 3:])[:, :, 0]
+        ok &= planes[:, 1] < -minSlope/registration.scale
+        residuals = np.abs(np.dot(planes, pts[:, :3].T) - pts[:, 3])
+        inliers = np.sum(residuals < tolerance, axis=1)*ok
+        best = np.argmax(inliers)
+        fraction = inliers[best]/float(len(pts))
+        if fraction < minFraction:
+            return fraction
+        
+        ###### refine with all inliers ######
+        sel = residuals[best] < tolerance
+        plane = np.linalg.lstsq(pts[sel, :3], pts[sel, 3], rcond=-1)[0]
+        onTable = np.zeros(z.shape, dtype=bool)
+        onTable[valid] = np.abs(np.dot(pts[:, :3], plane) - pts[:, 3]) < tolerance
+        rows = np.where(np.sum(onTable, axis=1) >= 0.5*np.max(np.sum(onTable, axis=1)))[0]
+        cols = np.sum(onTable[rows[0]:rows[-1]+1], axis=0)
+        cols = np.where(cols >= 0.5*np.max(cols))[0]
+        x1, x2 = cols[0]*step, min(cols[-1]*step + step - 1, depth.shape[1] - 1)
+        y1, y2 = rows[0]*step, min(rows[-1]*step + step - 1, depth.shape[0] - 1)
+        
+        self.initState = 3
+        self.points = []
+        for x, y in [(x2, y2), (x2, y1), (x1, y1)]: # front right, depth right, depth left
+            x, y = int(np.round(x)), int(np.round(y))
+            self.setPoint((x, y, float(np.dot(plane, [x, y, 1]))))
+        return fraction
     
     def filter(self):
         ''' substract table from frame with a variance of +8 and -3cm 
         
+        table - depth > 80 or < -30 is the same as |table - depth - 25| > 55,
+        evaluated in one pass into buffers reused for every frame
+        
         return: frame with filtered table
         '''
-        newDepth = np.zeros_like(self.depth)
-        newDepth[self.table - self.depth > 80] = self.depth[self.table - self.depth > 80]
-        newDepth[self.table - self.depth < -30] = self.depth[self.table - self.depth < -30]
-        return newDepth
\ No newline at end of file
+        if self.out is None or self.out.shape != self.depth.shape or self.out.dtype != self.depth.dtype:
+            self.diff = np.empty(self.depth.shape)
+            self.keep = np.empty(self.depth.shape, dtype=bool)
+            self.out = np.empty_like(self.depth)
+        np.subtract(self.table, self.depth, out=self.diff)
+        self.diff -= 25
+        np.abs(self.diff, out=self.diff)
+        np.greater(self.diff, 55, out=self.keep)
+        np.multiply(self.depth, self.keep, out=self.out)
+        return self.out
+
+    def save(self, filename):
+        ''' save the three table points (full resolution), the table
+        of one setup can be reused for all its recordings
+        '''
+        with open(filename, 'w') as ifile:
+            for pt in self.points:
+                ifile.write("%d %d %f\n" % registration.fullPoint(pt))
+
+    def load(self, filename):
+        ''' load table points saved by save and model table '''
+        self.initState = 3
+        self.points = []
+        with open(filename, 'r') as ifile:
+            for line in ifile:
+                entry = line.split()
+                if len(entry) == 3:
+                    self.setPoint(registration.scaledPoint((int(entry[0]), int(entry[1]), float(entry[2]))))
@@ -29,6 +29,65 @@ extRotation = np.array([[9.9998677518893e-01, -3.7700884771569e-03, -3.497982288
         [3.7402011469390e-03, 9.9995677981541e-01, -8.5117211272654e-03],
         [3.5299210472534e-03, 8.4985254039926e-03, 9.9995765646519e-01]] );
 
+###############################
+# processing resolution       #
+# depth intrinsics above are  #
+# scaled with it, VGA kept in #
+# fullIntrinsic               #
+###############################
+fullShape = (480, 640)
+fullIntrinsic = np.copy(depthIntrinsic)
+scale = 1.0
+shape = fullShape
+
+def setScale(newScale):
+    ''' set processing resolution relative to VGA (0.5: QVGA),
+    frames are downsampled by nearest neighbour: pixel x at
+    processing resolution is pixel x/scale at full resolution
+    '''
+    global scale, shape, depthCX, depthCY, depthFX, depthFY, depthIntrinsic
+    scale = float(newScale)
+    shape = (int(round(fullShape[0]*scale)), int(round(fullShape[1]*scale)))
+    depthIntrinsic = fullIntrinsic*scale
+    depthIntrinsic[2, 2] = 1
+    depthFX = depthIntrinsic[0, 0]
+    depthFY = depthIntrinsic[1, 1]
+    depthCX = depthIntrinsic[0, 2]
+    depthCY = depthIntrinsic[1, 2]
+    rays.clear()
+    registrations.clear()
+
+def fullPoint(pt):
+    ''' pixel (x,y,z) at processing resolution to full resolution '''
+    return (int(np.round(pt[0]/scale)), int(np.round(pt[1]/scale)), pt[2])
+
+def scaledPoint(pt):
+    ''' pixel (x,y,z) at full resolution to processing resolution '''
+    return (int(np.round(pt[0]*scale)), int(np.round(pt[1]*scale)), pt[2])
+
+def downsample(frame, out=None):
+    ''' full resolution frame to processing resolution '''
+    if scale == 1.0:
+        if out is None:
+            return frame
+        out[...] = frame
+        return out
+    res = cv2.resize(frame, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+    if out is None:
+        return res
+    out[...] = res
+    return out
+
+def intrinsicFor(frameShape):
+    ''' depth intrinsics of frames of frameShape: processing resolution,
+    otherwise full resolution intrinsics scaled to the frame width
+    '''
+    if frameShape == shape:
+        return depthIntrinsic
+    K = fullIntrinsic*(float(frameShape[1])/fullShape[1])
+    K[2, 2] = 1
+    return K
+
 def world2point(coord):
     ''' transforms a 3d-point to x-y coordinates
     of depth image
@@ -48,43 +107,104 @@ def point2world(coord):
     y = (y - depthCY)*z/depthFY
     return (x,y, z)
 
+rays = {}
+
+def getRays(shape):
+    ''' pixel grid and normalized rays (x-cx)/fx, (y-cy)/fy, 1 of a
+    depth frame with given shape (see intrinsicFor), calculated once
+    per shape
+
+    returns rays (h,w,3), gridX, gridY
+    '''
+    if shape not in rays:
+        gridX = np.arange(shape[1], dtype=float)
+        gridX = np.tile(gridX, (shape[0], 1))
+
+        gridY = np.arange(shape[0], dtype=float)
+        gridY = np.tile(gridY, (shape[1], 1)).T
+
+        K = intrinsicFor(shape)
+        ray = np.dstack(((gridX-K[0, 2])/K[0, 0],
+                         (gridY-K[1, 2])/K[1, 1],
+                         np.ones(shape)))
+        rays[shape] = (ray, gridX, gridY)
+    return rays[shape]
+
+def get3DworldImage(depth):
+    ''' transforms whole depth frame to a point cloud
+    image (h,w,3) with only one multiplication
+    '''
+    ray = getRays(depth.shape)[0]
+    return ray*depth[:, :, np.newaxis]
+
 def get3Dworld(depth):
     ''' transforms whole depth frame to
     a point cloud in 3d space
     
     aggregate numpy array operations for efficiency
     '''
-    gridX = np.arange(depth.shape[1], dtype=float)
-    gridX = np.tile(gridX, (depth.shape[0], 1))
+    ray, gridX, gridY = getRays(depth.shape)
+    world = get3DworldImage(depth).reshape((-1, 3)).T
+    return world, gridX, gridY
 
-    gridY = np.arange(depth.shape[0], dtype=float)
-    gridY = np.tile(gridY, (depth.shape[1], 1)).T
+class Registration(object):
+    '''
+    class to register rgb and depth frames with each other:
+    the coordinates of a point in the depth frame corrsponds
+    to the point in rgb frame
+    
+    - undistortion maps and rotated pixel rays are calculated once,
+      a frame is registered by remapping and one projection
+    - depth frames of shape (processing or full resolution, see
+      intrinsicFor), rgb frames at full resolution
+    '''
     
-    worldX= ((gridX-depthCX)* depth/depthFX).flatten()
-    worldY = ((gridY-depthCY)* depth/depthFY).flatten()
     
-    world = np.vstack((worldX, worldY, depth.flatten()))
-    return world, gridX, gridY
+    def __init__(self, shape=fullShape):
+        self.shape = shape
+        size = (shape[1], shape[0])
+        self.rgbMap = cv2.initUndistortRectifyMap(rgbIntrinsic, rgbDistortion, None,
+                                                  rgbIntrinsic, fullShape[::-1], cv2.CV_16SC2)
+        K = intrinsicFor(shape)
+        self.depthMap = cv2.initUndistortRectifyMap(K, depthDistortion, None,
+                                                    K, size, cv2.CV_16SC2)
+        # R^T (ray*z) + t = (R^T ray)*z + t, rows are rotated rays
+        self.rays = np.dot(getRays(shape)[0].reshape((-1, 3)), extRotation)
+        
+    def register(self, rgb, depth, out=None):
+        ''' registered rgb frame of rgb and depth '''
+        rgb = cv2.remap(rgb, self.rgbMap[0], self.rgbMap[1], cv2.INTER_LINEAR)
+        depth = cv2.remap(depth, self.depthMap[0], self.depthMap[1], cv2.INTER_LINEAR)
+        
+        p3d = self.rays*depth.reshape((-1, 1)) + extTranslation
+        rgbX = np.rint( (p3d[:, 0]*rgbFX/ p3d[:, 2]) + rgbCX).reshape(self.shape)
+        rgbY = np.rint( (p3d[:, 1]*rgbFY/ p3d[:, 2]) + rgbCY).reshape(self.shape)
+        
+        rgbX[depth>=4095] = 0
+        rgbX[depth<=0] = 0
+        rgbX = np.clip(rgbX, 0, rgb.shape[1]-1).astype(int)
+        rgbY = np.clip(rgbY, 0, rgb.shape[0]-1).astype(int)
+        
+        if out is None:
+            out = np.empty(self.shape + rgb.shape[2:], dtype=rgb.dtype)
+        out[...] = rgb[rgbY, rgbX]
+        return out
+    
+    def registerBatch(self, rgbs, depths):
+        ''' register many frames, returns array (frames, h, w, ...) '''
+        rgb = np.asarray(rgbs[0])
+        out = np.empty((len(rgbs),) + self.shape + rgb.shape[2:], dtype=rgb.dtype)
+        for i in range(len(rgbs)):
+            self.register(rgbs[i], depths[i], out[i])
+        return out
+
+registrations = {}
 
 def register(rgb, depth):
     ''' register rgb and depth frames with each other:
     the coordinates of a point in the depth frame corrsponds
     to the point in rgb frame
     '''
-    out= np.zeros_like(rgb)
-    rgb = cv2.undistort(rgb, rgbIntrinsic, rgbDistortion)
-    depth = cv2.undistort(depth, depthIntrinsic, depthDistortion)
-    
-    world, gridX, gridY = get3Dworld(depth)
-    p3d = np.dot(extRotation.T, world) + np.tile(extTranslation, (world.shape[1], 1)).T
-    
-    rgbX = np.rint( (p3d[0]*rgbFX/ p3d[2]) + rgbCX).reshape(480,640)
-    rgbY = np.rint( (p3d[1]*rgbFY/ p3d[2]) + rgbCY).reshape(480,640)
-
-    rgbX[depth>=4095] = 0
-    rgbX[depth<=0] = 0
-    
-    
-    out[gridY.astype(int), gridX.astype(int)] = rgb[rgbY.astype(int), rgbX.astype(int)]
-    return out
-    
\ No newline at end of file
+    if depth.shape not in registrations:
+        registrations[depth.shape] = Registration(depth.shape)
+    return registrations[depth.shape].register(rgb, depth)
@@ -0,0 +1,96 @@
+import time
+import json
+import threading
+from collections import deque
+import numpy as np
+
+#################################
+# switchable timing of stages,  #
+# disabled: stage() returns a   #
+# shared context doing nothing  #
+#################################
+enabled = False
+keepTrace = False
+window = 300
+frameIdx = -1
+durations = {}
+records = []
+origin = time.time()
+
+class NoStage(object):
+    ''' context of disabled timing '''
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        return False
+
+noStage = NoStage()
+
+class Stage(object):
+    ''' context measuring the duration of one stage '''
+    
+    
+    def __init__(self, name):
+        self.name = name
+        self.start = 0
+        
+    def __enter__(self):
+        self.start = time.time()
+        return self
+    
+    def __exit__(self, *args):
+        duration = time.time() - self.start
+        durations.setdefault(self.name, deque(maxlen=window)).append(duration)
+        if keepTrace:
+            records.append((self.name, frameIdx, self.start, duration,
+                            threading.current_thread().ident))
+        return False
+
+def stage(name):
+    ''' with stage("name"): ... measures the block if enabled '''
+    return Stage(name) if enabled else noStage
+
+def enable(trace=True):
+    ''' start measuring, with trace every single duration is kept '''
+    global enabled, keepTrace
+    enabled = True
+    keepTrace = trace
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    global records, origin
+    durations.clear()
+    records = []
+    origin = time.time()
+
+def setFrame(idx):
+    ''' frame index of the following stages (for the trace) '''
+    global frameIdx
+    frameIdx = idx
+
+def statistics():
+    ''' rolling statistics of the last window durations of every stage
+
+    returns dict name: (mean, p95, max, count) in seconds
+    '''
+    stats = {}
+    for name, d in durations.items():
+        d = np.asarray(d)
+        stats[name] = (np.mean(d), np.percentile(d, 95), np.max(d), len(d))
+    return stats
+
+def report():
+    for name, (mean, p95, mx, n) in sorted(statistics().items()):
+        print "%-36s %8.3f ms mean %8.3f ms p95 %8.3f ms max (%d)" % (name, mean*1000, p95*1000, mx*1000, n)
+
+def dumpTrace(filename):
+    ''' write kept durations as chrome trace (chrome://tracing) '''
+    events = [{'name': name, 'ph': 'X', 'pid': 0, 'tid': tid,
+               'ts': (start - origin)*1e6, 'dur': duration*1e6,
+               'args': {'frame': idx}}
+              for name, idx, start, duration, tid in records]
+    with open(filename, 'w') as ifile:
+        json.dump({'traceEvents': events}, ifile)
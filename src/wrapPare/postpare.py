@@ -1,6 +1,112 @@
+import os
+import numpy as np
+from process.history import formatRows
+
 def saveHistory(filename, history):
     content = history.dump()
     with open(filename, 'w') as ifile:
-        ifile.write(" ".join(history.states.keys()) + "\n")
+        ifile.write(" ".join(history.joints) + "\n")
         ifile.write("pt, angle, v\n")
-        ifile.write(content)
\ No newline at end of file
+        ifile.write(content)
+
+def loadHistory(filename, history):
+    ''' load the tracked frames of a (partially written) text label file
+    into history, an incomplete last row of an interrupted write is ignored,
+    columns are assigned by the joints of the header (files of older versions
+    have another joint order)
+    
+    returns number of loaded frames
+    '''
+    width = len(history.joints)*history.data.shape[2]
+    with open(filename, 'r') as ifile:
+        joints = ifile.readline().split()
+        if sorted(joints) != sorted(history.joints):
+            raise ValueError("label file %s has joints %s" % (filename, joints))
+        order = [joints.index(joint) for joint in history.joints]
+        ifile.readline()
+        rows = []
+        for line in ifile:
+            entry = line.split()
+            if len(entry) != width or not line.endswith("\n"):
+                break
+            rows.append([float(x) for x in entry])
+    n = min(len(rows), len(history))
+    if n > 0:
+        history.setFrames(0, np.asarray(rows[:n]).reshape((n,) + history.data.shape[1:])[:, order])
+    history.dirty = len(history) # same as file
+    return n
+
+class HistoryWriter(object):
+    '''
+    class writing the text label file while tracking, so an interrupted
+    session can be resumed (see loadHistory)
+    
+    - all stored frames (valid and stale, see StateHistory) are written
+    - newly stored frames are appended in batches of batch frames
+    - the file is rewritten as soon as a batch of frames from the first
+      changed written frame (history.dirty) on is stored again
+    - written: number of rows of the file loaded into history (see
+      loadHistory), an existing file which was not loaded is kept as .bak
+    - a rewrite goes to filename.part first and then replaces the file,
+      an interrupted rewrite leaves the previous file
+    '''
+    
+    
+    def __init__(self, filename, history, written=0, batch=100):
+        self.filename = filename
+        self.history = history
+        self.batch = batch
+        self.written = written
+        if written == 0:
+            if os.path.exists(filename):
+                if os.path.exists(filename + ".bak"):
+                    os.remove(filename + ".bak")
+                os.rename(filename, filename + ".bak")
+            self.rewrite(0)
+        
+    def rewrite(self, end):
+        ''' write file with the first end frames '''
+        partFile = self.filename + ".part"
+        with open(partFile, 'w') as ifile:
+            ifile.write(" ".join(self.history.joints) + "\n")
+            ifile.write("pt, angle, v\n")
+            ifile.write(formatRows(self.history.rows(0, end)))
+        if os.name == 'nt' and os.path.exists(self.filename):
+            os.remove(self.filename) # rename does not replace on windows
+        os.rename(partFile, self.filename)
+        self.written = end
+        self.history.dirty = len(self.history)
+        
+    def update(self, flush=False):
+        ''' write changed and new frames if a batch is complete (or flush) '''
+        end = self.history.stored()
+        low = min(self.history.dirty, end)
+        if low < self.written:
+            if flush or end - low >= self.batch:
+                self.rewrite(end)
+        elif end - self.written >= self.batch or (flush and end > self.written):
+            with open(self.filename, 'a') as ifile:
+                ifile.write(formatRows(self.history.rows(self.written, end)))
+            self.written = end
+            self.history.dirty = len(self.history)
+
+def saveHistoryBinary(filename, history):
+    ''' save history as structured array (.npy), joint names and
+    field layout are part of the header
+    '''
+    np.save(filename, history.records())
+
+def loadHistoryBinary(filename):
+    ''' memory-mapped labels of a binary label file, a state is
+    accessed by labels[frameIdx][joint][field]
+    '''
+    return np.load(filename, mmap_mode='r')
+
+def binary2text(filename, textFilename):
+    ''' convert binary label file to text label file '''
+    labels = loadHistoryBinary(filename)
+    rows = labels.view(float).reshape(len(labels), -1)
+    with open(textFilename, 'w') as ifile:
+        ifile.write(" ".join(labels.dtype.names) + "\n")
+        ifile.write("pt, angle, v\n")
+        ifile.write(formatRows(rows))
@@ -0,0 +1,78 @@
+import os
+import numpy as np
+from multiprocessing import Pool
+import registration
+from frames.source import openSource
+from wrapPare.prepare import Prepare
+
+#################################
+# skeleton frames depend only   #
+# on frame and setup: they are  #
+# calculated ahead of the fit   #
+# by a process pool into a file #
+#################################
+worker = None
+
+def cacheShape(nFrames):
+    ''' shape of skeleton cache: binary frames packed 8 pixels per byte '''
+    return (nFrames, registration.shape[0], (registration.shape[1] + 7)//8)
+
+def unpack(packed):
+    ''' skeleton frame (0/255) of a packed cache entry '''
+    return np.unpackbits(packed, axis=1)[:, :registration.shape[1]]*np.uint8(255)
+
+def initWorker(filename, setup, scale):
+    ''' open recording and setup once per process '''
+    global worker
+    registration.setScale(scale)
+    prep = Prepare(None)
+    prep.loadSetup(setup)
+    worker = (openSource(filename), prep)
+
+def precomputeChunk(args):
+    ''' skeleton frames first..last-1 into cache file '''
+    cacheFile, first, last = args
+    source, prep = worker
+    images = np.load(cacheFile, mmap_mode='r+')
+    depth = np.empty(registration.shape, dtype=np.float32)
+    for i in range(first, last):
+        source.read(i, i == first, depth)
+        prep.table.depth = depth
+        filtered = prep.apply()
+        skeleton = prep.preprocessing.apply(filtered, prep.mask)
+        images[i] = np.packbits(skeleton != 0, axis=1)
+    images.flush()
+    return last - first
+
+def isValid(cacheFile, setup, nFrames):
+    ''' cache is complete (renamed after calculation), not older than
+    setup and of current resolution
+    '''
+    if not os.path.exists(cacheFile) or os.path.getmtime(cacheFile) < os.path.getmtime(setup):
+        return False
+    return np.load(cacheFile, mmap_mode='r').shape == cacheShape(nFrames)
+
+def precompute(filename, setup, nFrames, cacheFile=None, processes=None, chunk=100):
+    ''' skeleton frames of all frames of recording filename with setup
+    (see Prepare.saveSetup) at current resolution, calculated in a
+    pool of processes (default: one per cpu), a valid cache is reused
+    
+    returns memory-mapped cache (frames, h, w/8), see unpack
+    '''
+    if cacheFile is None:
+        cacheFile = filename + ".skeleton.npy"
+    if not isValid(cacheFile, setup, nFrames):
+        partFile = cacheFile + ".part.npy"
+        images = np.lib.format.open_memmap(partFile, mode='w+', dtype=np.uint8,
+                                           shape=cacheShape(nFrames))
+        del images
+        chunks = [(partFile, first, min(first + chunk, nFrames)) for first in range(0, nFrames, chunk)]
+        pool = Pool(processes, initWorker, (filename, setup, registration.scale))
+        try:
+            pool.map(precomputeChunk, chunks)
+        finally:
+            pool.terminate()
+        if os.path.exists(cacheFile):
+            os.remove(cacheFile) # stale cache, rename does not replace on windows
+        os.rename(partFile, cacheFile)
+    return np.load(cacheFile, mmap_mode='r')
@@ -1,7 +1,11 @@
+import os
 import cv2
 import numpy as np
+import registration
+import timing
 from process.tableModel import Table
 from process.joint import Skeleton
+from process.preprocess import Preprocessing
 
 class Prepare(object):
     '''
@@ -19,6 +23,7 @@ class Prepare(object):
         self.threshold = None
         self.showImage = None
         self.mask = None
+        self.preprocessing = Preprocessing()
         
     def setApoint(self, event, x, y, flag, param):
         ''' interface for function setPoint '''
@@ -28,8 +33,21 @@ class Prepare(object):
         param.setPoint(pt)
         cv2.circle(self.showImage, (x,y), 5, (255,255,0))
         
-    def tabling(self):
-        ''' window to choose points on the table '''
+    def tabling(self, tableFile=None, auto=True):
+        ''' window to choose points on the table,
+        if tableFile exists the table is loaded from it instead,
+        otherwise the chosen table is saved to it
+        
+        with auto the table is detected in the first frames,
+        the window is only shown if detection fails
+        '''
+        if tableFile is not None and os.path.exists(tableFile):
+            self.table.load(tableFile)
+            return
+        if auto and self.detectTable():
+            if tableFile is not None:
+                self.table.save(tableFile)
+            return
         frame = self.app.getFrame(0)
         self.frame = frame
         self.showImage = cv2.cvtColor(self.app.normFrame(frame), cv2.COLOR_GRAY2BGR)
@@ -39,8 +57,21 @@ class Prepare(object):
             cv2.imshow("click 3 points on the table", self.showImage)
             cv2.waitKey(5)
         cv2.destroyWindow("click 3 points on the table")
+        if tableFile is not None:
+            self.table.save(tableFile)
             
     
+    def detectTable(self, nFrames=5):
+        ''' detect table in median of first nFrames frames (see Table.detect)
+        
+        returns True if table is found
+        '''
+        n = min(nFrames, self.app.source.getNumberOfFrames())
+        frames = np.asarray([self.app.getFrame(i) for i in range(n)])
+        confidence = self.table.detect(frames)
+        print "table detection: %.0f%% of frame on table" % (confidence*100)
+        return self.table.initState <= 0
+    
     def posture(self):
         ''' window to set intital skeleton joints '''
         frame = self.app.getFrame(0)
@@ -69,10 +100,8 @@ class Prepare(object):
         cv2.createTrackbar("Threshold z Low", "depth image", threshZLo, 1000, lambda x: None)
         incr = 0
         
-        cannyTop = 30;
-        cannyBot = 15
         while True:
-            if incr >= self.app.player.get_number_of_frames(self.app.depth_stream):
+            if incr >= self.app.source.getNumberOfFrames():
                 incr = 0
             frame = self.app.getFrame(incr)
             
@@ -84,11 +113,7 @@ class Prepare(object):
             
             maskd = self.masking(frame, threshold)
             
-            masked = np.copy(maskd*frame)
-            masked = masked/(np.max(masked)-np.min(masked))-np.min(masked)
-            masked *= 255.
-            masked = np.rint(masked).astype(np.uint8)
-            canny = cv2.Canny(masked, cannyBot, cannyTop)
+            canny = self.preprocessing.edges(maskd*frame)
             cv2.imshow("depth image", self.app.normFrame(frame*maskd))
             cv2.imshow("canny", canny)
             
@@ -101,6 +126,54 @@ class Prepare(object):
         cv2.destroyWindow("depth image")
         cv2.destroyWindow("canny")
         
+    def estimateThreshold(self, nFrames=20, binWidth=20, minPeak=0.05, reach=800):
+        ''' estimate thresholds for far and near values from the depth
+        histogram of nFrames frames sampled over the recording instead
+        of the slider bars (see thresholding)
+        
+        - the table (if known) is not counted
+        - the patient is at the depth of head and shoulders (if posture
+          is known), otherwise at the nearest peak with at least minPeak
+          of the pixels
+        - far: middle of the deepest histogram valley between patient and
+          the next peak behind (background), near: patient - reach mm (arms)
+        
+        returns threshold, the slider bar defaults if no depth is left
+        '''
+        n = self.app.source.getNumberOfFrames()
+        frames = np.asarray([self.app.getFrame(i) for i in np.unique(np.linspace(0, n-1, nFrames).astype(int))])
+        valid = frames > 0
+        if self.table.table is not None:
+            valid &= np.abs(self.table.table - frames - 25) > 55
+        if not np.any(valid):
+            # nothing to estimate from: defaults of the slider bars (see thresholding)
+            self.threshold = (1*1000 + 200, 2*1000 + 400)
+            print "no depth values, default thresholds:", self.threshold
+            return self.threshold
+        hist = np.bincount((frames[valid]/binWidth).astype(int))
+        hist = np.convolve(hist, np.ones(5)/5.0, 'same')
+        
+        ###### significant peaks ######
+        peaks = np.where((hist[1:-1] >= hist[:-2]) & (hist[1:-1] > hist[2:]) &
+                         (hist[1:-1]*5 >= minPeak*np.count_nonzero(valid)))[0] + 1
+        if len(self.skeleton.points) >= 3:
+            body = int(np.median([pt[2] for pt in self.skeleton.points[:3]])/binWidth)
+        elif len(peaks) > 0:
+            body = peaks[0]
+        else:
+            body = int(np.argmax(hist))
+        behind = peaks[peaks > body + reach/(2*binWidth)]
+        if len(behind) > 0:
+            valley = hist[body:behind[0]]
+            valley = np.where(valley <= np.min(valley) + 1e-6)[0]
+            valley = valley[:np.argmax(np.diff(np.append(valley, -1)) != 1) + 1] # first run of minima
+            far = body + (valley[0] + valley[-1])//2
+        else:
+            far = body + reach/binWidth
+        self.threshold = (int(max(body*binWidth - reach, 1)), int(far*binWidth))
+        print "estimated thresholds:", self.threshold
+        return self.threshold
+        
     def masking(self, frame, threshold):
         ''' accepts tuple of thresholds for far and near,
         set frame to zero where values are outside these limits
@@ -123,6 +196,41 @@ class Prepare(object):
         
     def apply(self):
         ''' filter table and apply threhsold mask '''
-        depth = self.table.filter()
-        depth *= self.masking(depth, self.threshold)
+        with timing.stage("Table.filter"):
+            depth = self.table.filter()
+        with timing.stage("Prepare.masking"):
+            depth *= self.masking(depth, self.threshold)
         return depth
+
+    def saveSetup(self, filename):
+        ''' save thresholds, table points and initial posture in order
+        to track the same recording again without any windows,
+        points are saved at full resolution
+        '''
+        with open(filename, 'w') as ifile:
+            ifile.write("threshold %d %d\n" % tuple(self.threshold))
+            for pt in self.table.points:
+                ifile.write("table %d %d %f\n" % registration.fullPoint(pt))
+            for pt in self.skeleton.points:
+                ifile.write("posture %d %d %f\n" % registration.fullPoint(pt))
+
+    def loadSetup(self, filename):
+        ''' load setup written by saveSetup, points are set in the
+        same order as they were clicked
+
+        returns skeleton
+        '''
+        with open(filename, 'r') as ifile:
+            for line in ifile:
+                entry = line.split()
+                if len(entry) == 0:
+                    continue
+                if entry[0] == 'threshold':
+                    self.threshold = (int(entry[1]), int(entry[2]))
+                elif entry[0] == 'table':
+                    pt = (int(entry[1]), int(entry[2]), float(entry[3]))
+                    self.table.setPoint(registration.scaledPoint(pt))
+                elif entry[0] == 'posture':
+                    pt = (int(entry[1]), int(entry[2]), float(entry[3]))
+                    self.skeleton.setPoint(registration.scaledPoint(pt))
+        return self.skeleton